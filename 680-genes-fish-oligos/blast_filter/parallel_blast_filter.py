@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# ------------------------------------------------------------------------------
+# 
+# Author: Gabriele Girelli
+# Email: gigi.ga90@gmail.com
+# Version: 1.0.0
+# Date: 20170724
+# Project: 680 genes
+# Description:	filter every gene fasta of a folder based on the filtered and
+# 				rearranged BLASTN output, in parallel. Native replacement of
+# 				parallel_blast_filter.sh, with the same options.
+# 
+# Notes:
+# 		The STG and gene symbol tables are read once, before the workers are
+# 		forked, so that every worker shares them copy-on-write.
+# 		Genes are scheduled largest-first.
+# 
+# ------------------------------------------------------------------------------
+
+
+
+# DEPENDENCIES =================================================================
+
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import os
+
+# PARAMETERS ===================================================================
+
+# Add script description
+parser = argparse.ArgumentParser(
+	description = 'Run blast_filter in parallel on every fasta of indir.'
+)
+
+# Add mandatory arguments
+parser.add_argument('-i', type = str, nargs = 1, required = True,
+	metavar = 'stg', help = """
+	Table with oligo_sequence|transcript_ID|Gene_Symbol columns.""")
+parser.add_argument('-y', type = str, nargs = 1, required = True,
+	metavar = 'gs', help = """
+	Table with Gene_Symbol|gene_ID columns.""")
+parser.add_argument('-f', type = str, nargs = 1, required = True,
+	metavar = 'indir', help = """
+	Folder with gene fasta file.""")
+parser.add_argument('-o', type = str, nargs = 1, required = True,
+	metavar = 'outdir', help = """
+	Output folder.""")
+
+# Add arguments with default value
+parser.add_argument('-k', type = int, nargs = 1,
+	metavar = 'k', help = """
+	Oligo length. Default: 30""", default = [30])
+parser.add_argument('-g', type = int, nargs = 1,
+	metavar = 'gt', help = """
+	Threshold on the number of off-targets gene, for a single oligo.
+	Default: 20""", default = [20])
+parser.add_argument('-s', type = int, nargs = 1,
+	metavar = 'st', help = """
+	Threshold on the number of oligos off-targeting a gene, for the
+	selections of 'saturated' off-target genes. Oligos targeting a
+	saturated off-target are filtered out. Default: 5""", default = [5])
+parser.add_argument('-t', type = int, nargs = 1,
+	metavar = 'threads', help = """
+	Number of threads for parallelization. Default: 1""", default = [1])
+
+# Parse arguments
+args = parser.parse_args()
+
+# Assign to in-script variables
+stg_path = args.i[0]
+gst_path = args.y[0]
+fin_path = args.f[0]
+fout_path = args.o[0]
+k = args.k[0]
+gene_ot_thr = args.g[0]
+saturation_level = args.s[0]
+threads = max(1, args.t[0])
+
+# Check options
+if 0 >= k:
+	parser.error("Invalid -k option, k must be greater than 0.")
+if 0 >= gene_ot_thr:
+	parser.error("Invalid -g option, gt must be greater than 0.")
+if 0 >= saturation_level:
+	parser.error("Invalid -s option, st must be greater than 0.")
+for (opt, path) in (('-i', stg_path), ('-y', gst_path), ('-f', fin_path)):
+	if not os.path.exists(path):
+		parser.error("Invalid %s option, file not found.\n File: %s" % (
+			opt, path))
+if os.path.exists(fout_path) and not os.path.isdir(fout_path):
+	parser.error("Invalid -o option, a file exists with the folder name.")
+
+# Create outdir if it does not exist
+if not os.path.isdir(fout_path):
+	os.makedirs(fout_path)
+
+# Print settings
+print("""
+ SETTINGS:
+
+         stg_file : %s
+            indir : %s
+           outdir : %s
+gene symbol table : %s
+
+                k : %d nt
+          #OT thr : %d
+   Saturation lvl : %d
+
+          threads : %d
+""" % (stg_path, fin_path, fout_path, gst_path,
+	k, gene_ot_thr, saturation_level, threads))
+
+# FUNCTIONS ====================================================================
+
+def read_stg(stg_path):
+	'''
+	Args:
+		stg_path (string): path to oligo_sequence|transcript_ID|Gene_Symbol table.
+
+	Return:
+		dict: oligo_sequence:[(transcript_ID, Gene_Symbol), ...] dictionary.
+	'''
+
+	stg = {}
+	with open(stg_path) as f:
+		for line in f:
+			(seq, trans, gene) = line.rstrip('\n').split('\t')[:3]
+			stg.setdefault(seq, []).append((trans, gene))
+	return(stg)
+
+def read_gst(gst_path):
+	'''
+	Args:
+		gst_path (string): path to Gene_Symbol|gene_ID table.
+
+	Return:
+		dict: gene_ID:Gene_Symbol dictionary.
+	'''
+
+	gst = {}
+	with open(gst_path) as f:
+		for line in f:
+			tmp = line.rstrip('\n').split('\t')
+			gst[tmp[1]] = tmp[0]
+	return(gst)
+
+def read_fasta(fain_path):
+	'''
+	Args:
+		fain_path (string): path to fasta file, one sequence line per record.
+
+	Return:
+		list: (header, sequence) tuples, header without the leading '>'.
+	'''
+
+	fa = []
+	with open(fain_path) as f:
+		head = None
+		for line in f:
+			if '>' == line[0]:
+				head = line[1:].strip()
+			elif head is not None:
+				fa.append((head, line.strip()))
+				head = None
+	return(fa)
+
+def sort_key(record):
+	'''Sort records by transcript and oligo position.'''
+	ff = record[0].split('_')
+	return((ff[1], int(ff[2].split(':')[0][1:]), record[0]))
+
+def format_header(head, k):
+	'''Add (start-end) oligo position to the header.'''
+	ff = head.split('_')
+	oo = ff[2].split(':')
+	oi = int(oo[0][1:])
+	return("%s_%s:(%d-%d):%s" % (ff[0], ff[1], oi + 1, oi + k,
+		':'.join(oo[1:4])))
+
+def blast_filter(fain_path, faout_path, gene_symbol):
+	'''
+	Filter a gene fasta based on the number of off-targets and on saturated
+	off-target transcripts. Reads the STG table and thresholds from the
+	module-level variables inherited from the parent process.
+
+	Args:
+		fain_path (string): path to input gene fasta.
+		faout_path (string): path to output fasta.
+		gene_symbol (string): symbol of the targeted gene.
+
+	Return:
+		string: path to input gene fasta.
+	'''
+
+	logf = open(faout_path + ".log", 'w')
+	log = lambda msg: logf.write(msg + "\n")
+
+	# Log Gene name
+	log(" · %s" % (gene_symbol,))
+
+	# Read fasta input
+	fa_out = read_fasta(fain_path)
+
+	# Count oligos
+	n_oligo = len(fa_out)
+	log(" · Found %d %d-mers..." % (n_oligo, k))
+
+	# Unique sequences from fasta input
+	log(" · Extracting fasta uniqued sequences ...")
+	useq = set(seq for (head, seq) in fa_out)
+	log(" >>> Found %d unique %d-mers." % (len(useq), k))
+
+	# Extract from STG
+	log(" · Extracting STG lines ...")
+	stg_ot = [(seq, trans, gene) for seq in useq
+		for (trans, gene) in STG.get(seq, ())]
+
+	# Remove correct targets
+	log(" · Focusing on off-targets...")
+	stg_ot = [row for row in stg_ot if row[2] != gene_symbol]
+
+	# OFF-TARGET FILTER #1 -----------------------------------------------------
+	# #OT filter
+
+	# Count off-targets per sequence
+	log(" · Counting off-targets per sequence...")
+	seq_count = Counter(seq for (seq, trans, gene) in stg_ot)
+	torm_seq = set(seq for (seq, n) in seq_count.items() if n >= gene_ot_thr)
+
+	if 0 != len(torm_seq):
+		log(" >>> Removing sequences...")
+
+		# Remove
+		fa_out = [r for r in fa_out if not r[1] in torm_seq]
+		stg_ot = [row for row in stg_ot if not row[0] in torm_seq]
+
+		# Count
+		n_rm_oligo = n_oligo - len(fa_out)
+		n_oligo = len(fa_out)
+
+		# Log
+		log(" >>> %d removed sequences had too many off-targets." % (
+			len(torm_seq),))
+		log(" >>> %d removed oligos had too many off-targets." % (n_rm_oligo,))
+	else:
+		log(" >>> 0 removed sequences had too many off-targets.")
+
+	# OFF-TARGET FILTER #2 -----------------------------------------------------
+	# Saturation filter
+
+	if 0 == len(fa_out):
+		log(" · Skipping saturated off-target transcripts filter...")
+	else:
+		# Count hits per off-target transcript
+		log(" · Identifying saturated off-target transcripts...")
+		trans_count = Counter(trans for (seq, trans, gene) in stg_ot)
+		torm_trans = set(trans for (trans, n) in trans_count.items()
+			if n >= saturation_level)
+		log(" >>> Found %d saturated transcripts." % (len(torm_trans),))
+
+		# Identify sequences hitting on saturated transcripts
+		torm_seq = set(seq for (seq, trans, gene) in stg_ot
+			if trans in torm_trans)
+
+		if 0 != len(torm_seq):
+			log(" >>> Removing sequences...")
+
+			# Remove
+			fa_out = [r for r in fa_out if not r[1] in torm_seq]
+
+			# Count
+			n_rm_oligo = n_oligo - len(fa_out)
+
+			# Log
+			log(" >>> Found %d sequences hitting saturated transcripts." % (
+				len(torm_seq),))
+			log(" >>> Removed %d oligos hitting saturated transcripts." % (
+				n_rm_oligo,))
+		else:
+			log(" >>> Found 0 sequences hitting saturated transcripts.")
+
+	# OUTPUT ===================================================================
+
+	if 0 != len(fa_out):
+
+		# Sort output
+		fa_out.sort(key = sort_key)
+
+		# Write output
+		log(" · Writing output (%d oligos)..." % (len(fa_out),))
+		with open(faout_path, 'w') as f:
+			f.write("".join(">%s\n%s\n" % (format_header(head, k), seq)
+				for (head, seq) in fa_out))
+	else:
+		log(" · No output.")
+		open(faout_path, 'w').close()
+
+	logf.close()
+	return(fain_path)
+
+# RUN ==========================================================================
+
+# Read shared tables, before forking
+print(" · Reading STG table...")
+STG = read_stg(stg_path)
+print(" · Reading gene symbol table...")
+gst = read_gst(gst_path)
+
+print(" · Preparing jobs...")
+jobs = []
+for f in os.listdir(fin_path):
+	if not f.endswith('.fa'):
+		continue
+
+	# Gene symbol
+	ensg = f.split('.')[0]
+	if not ensg in gst.keys():
+		print(" !!! Skipping %s, gene symbol not found." % (f,))
+		continue
+
+	fain = os.path.join(fin_path, f)
+	jobs.append((os.path.getsize(fain), fain,
+		os.path.join(fout_path, f), gst[ensg]))
+
+# Largest genes first
+jobs.sort(reverse = True)
+
+print(" · Submitting jobs...")
+with ProcessPoolExecutor(max_workers = threads,
+	mp_context = multiprocessing.get_context('fork')) as pool:
+	futures = [pool.submit(blast_filter, fain, faout, gs)
+		for (size, fain, faout, gs) in jobs]
+	for future in as_completed(futures):
+		print(os.path.basename(future.result()).split('.')[0])
+
+print(" ~ DONE ~")
+
+# END ==========================================================================
+
+################################################################################
@@ -9,56 +9,254 @@ Project: COSMIC oligos
 Aim:
 	Characterize oligos: GC content, melting temperature/
 
+Notes:
+	Progress is tracked on the input byte offset, in a single pass.
+	Oligos are characterized in batches (-b), with a NumPy nearest-neighbour
+	engine that gives the same values as the per-oligo characterize().
+	With -t, the input is split in byte-range chunks aligned on line ends,
+	characterized in a process pool, and written back in input order.
+	With -r, the input is a fasta file with each sequence in one line, and
+	every k-mer of every sequence is characterized with a rolling window.
+	Output rows are then prefixed by the k-mer ID (ID_O<i>), as in
+	mk_oligos.py. The cache (-c) and the store (--store) are not used in
+	rolling window mode, and cannot be set.
+	Oligos up to 32 nt are deduplicated with a bounded LRU cache (-c), keyed
+	by their 2-bit packed sequence, so that the k-mers shared by transcript
+	isoforms are characterized only once.
+	With --store, concentration-independent properties (dH, dS, GC count
+	and longest homopolymer stretch) are kept in a persistent SQLite store,
+	and reused across runs with any oligo concentration and homopolymer
+	length.
+	With -m, additional Tm variants are computed in the same pass, and
+	appended as extra columns, in order. Variants are given as
+	MODEL[,na=M][,fa=PERC], with a model from the registry (MODELS), an
+	optional Na+ molar concentration for entropy salt correction
+	(SantaLucia, PNAS(95), 1998), and an optional formamide percentage
+	(-0.63 C per %, McConaughy et al., Biochemistry(8), 1969).
+	With --skipped, oligos skipped for Ns are reported in a BED-like file.
+	In rolling window mode, rows are the N regions of each sequence (see
+	packed_seq.skipped_regions), whose overlapping k-mers are never
+	characterized. Otherwise, rows are the skipped input lines, with the
+	input path as ID and 0-indexed line numbers as coordinates.
+	Input and output can be compressed (.gz, .bgz, .zst), by extension.
+	Compressed input is read serially, as -t needs byte ranges.
+
 '''
 
 # DEPENDENCIES =================================================================
 
 import argparse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import math
-import progressbar
-import time
+import multiprocessing
+import os
+import sqlite3
+from functools import partial
+import numpy as np
+
+from compressed_io import compression, xopen
+from mk_oligos import fasta_records
+from packed_seq import MASK, MAX_PACKED_LEN, NT, clean_kmer_positions, \
+	encode, format_skipped, is_palindrome, is_palindrome_codes, pack_2bit, \
+	revcomp, skipped_regions
+from progress import FileProgress
 
 # PARAMETERS ===================================================================
 
+def parse_arguments():
+	'''Parse command line arguments.'''
+
+	# Add script description
+	parser = argparse.ArgumentParser(
+		description = 'Characterize k-mers from fasta file without headers.'
+	)
+
+	# Add mandatory arguments
+	parser.add_argument('fastaInput', type = str, nargs = 1,
+		help = 'Path to input fasta file.')
+	parser.add_argument('output', type = str, nargs = 1,
+		help = 'Path to output tsv file.')
+
+	# Add arguments with default value
+	parser.add_argument('-o', '--oligoconc', type = int, nargs = 1,
+		metavar = 'oligoConc', help = """
+		Oligo molar concentration. Default: 0.25e-6
+		""", default = [0.25e-6])
+	parser.add_argument('-l', '--hplen', type = int, nargs = 1,
+		metavar = 'hplen', help = """
+		Homopolymer stretch length in nt. Default: 4 nt
+		""", default = [4])
+	parser.add_argument('-b', '--batch', type = int, nargs = 1,
+		metavar = 'batch', help = """
+		Number of oligos characterized at once. Default: 10000
+		""", default = [10000])
+	parser.add_argument('-t', '--threads', type = int, nargs = 1,
+		metavar = 'threads', help = """
+		Number of threads for parallelization. Default: 1
+		""", default = [1])
+	parser.add_argument('-c', '--cache', type = int, nargs = 1,
+		metavar = 'size', help = """
+		Maximum number of distinct oligos kept in the cache, per process.
+		Use 0 to disable the cache. Default: 1000000
+		""", default = [None])
+	parser.add_argument('--store', type = str, nargs = 1,
+		metavar = 'db', help = """
+		Path to a persistent SQLite oligo store, created if missing. Used
+		instead of the cache.""", default = [None])
+	parser.add_argument('-m', '--tm-model', type = str, action = 'append',
+		metavar = 'variant', help = """
+		Additional Tm variant, as MODEL[,na=M][,fa=PERC]. E.g., 'dna,na=0.39',
+		'rna_dna,na=0.3,fa=25'. Can be repeated, one TSV column per variant.
+		Models: dna (Allawi&Santalucia, 1997), rna_dna (RNA/DNA hybrid,
+		Sugimoto et al., 1995; sequences are the RNA strand).""",
+		default = [])
+	parser.add_argument('-r', '--rolling', type = int, nargs = 1,
+		metavar = 'k', help = """
+		Characterize every k-mer of the sequences of a fasta file, with a
+		rolling window of k nt.""", default = [None])
+	parser.add_argument('--skipped', type = str, nargs = 1,
+		metavar = 'bed', help = """
+		Path to BED-like report of the oligos skipped for Ns, with columns:
+		ID, start, end, <length>mer, number of skipped oligos.""",
+		default = [None])
+
+	# Add flags
+	parser.add_argument('--no-progress',
+		action = 'store_const', dest = 'no_progress',
+		const = True, default = False,
+		help = 'Do not show the progress bar.')
+
+	# Parse arguments
+	args = parser.parse_args()
+
+	if not args.rolling[0] is None and 1 < args.threads[0]:
+		parser.error("-t is not supported in rolling window mode (-r).")
+	if 1 < args.threads[0] and not compression(args.fastaInput[0]) is None:
+		parser.error("-t is not supported with compressed input.")
+	if not args.rolling[0] is None and 0 != len(args.tm_model):
+		parser.error("-m is not supported in rolling window mode (-r).")
+	if not args.rolling[0] is None and not args.cache[0] is None:
+		parser.error("-c is not supported in rolling window mode (-r).")
+	if not args.rolling[0] is None and not args.store[0] is None:
+		parser.error("--store is not supported in rolling window mode (-r).")
+	if args.cache[0] is None:
+		args.cache = [1000000]
+	try:
+		args.tm_model = [parse_tm_variant(spec) for spec in args.tm_model]
+	except ValueError as e:
+		parser.error("Invalid -m option. %s" % (e,))
+
+	return(args)
+
+# Input chunk size in bytes, in parallel mode
+CHUNK_BYTES = 8 * 1024 * 1024
+
+# Oligo cache of the current worker process, in parallel mode
+WORKER_CACHE = None
+
+# Gas constant
+R = 1.987 / 1000	# kcal / (K mol)
+
+# Table from Allawi&Santalucia, Biochemistry(36), 1997 - in 1 M NaCl [DNA]
+# dH0: kcal / mol
+# dS0: eu = cal / (K mol)
+# dG0: kcal / mol
+tt = {
+	#				 dH0	 dS0 	 dG0
+	'AA'		:	(-7.9,	-22.2,	-1.0),
+	'TT'		:	(-7.9,	-22.2,	-1.0),
+	'AT'		:	(-7.2,	-20.4,	-0.88),
+	'TA'		:	(-7.2,	-21.3,	-0.58),
+	'CA'		:	(-8.5,	-22.7,	-1.45),
+	'TG'		:	(-8.5,	-22.7,	-1.45),
+	'GT'		:	(-8.4,	-22.4,	-1.44),
+	'AC'		:	(-8.4,	-22.4,	-1.44),
+	'CT'		:	(-7.8,	-21.0,	-1.28),
+	'AG'		:	(-7.8,	-21.0,	-1.28),
+	'GA'		:	(-8.2,	-22.2,	-1.3),
+	'TC'		:	(-8.2,	-22.2,	-1.3),
+	'CG'		:	(-10.6,	-27.2,	-2.17),
+	'GC'		:	(-9.8,	-24.4,	-2.24),
+	'GG'		:	(-8.0,	-19.9,	-1.84),
+	'CC'		:	(-8.0,	-19.9,	-1.84),
+	'endG'		:	(.1,	-2.8,	.98),
+	'endC'		:	(.1,	-2.8,	.98),
+	'endA'		:	(2.3,	4.1,	1.03),
+	'endT'		:	(2.3,	4.1,	1.03),
+	'has_end'	:	True,
+	'sym'		:	(2.3,	4.1,	1.03),
+	'has_sym'	:	True
+}
+
+# Nearest-neighbour and initiation tables, by nucleotide code
+NN_DH = np.array([[tt[a + b][0] for b in NT] for a in NT])
+NN_DS = np.array([[tt[a + b][1] for b in NT] for a in NT])
+END_DH = np.array([tt['end' + a][0] for a in NT])
+END_DS = np.array([tt['end' + a][1] for a in NT])
+
+# Table from Sugimoto et al., Biochemistry(34), 1995 - in 1 M NaCl [RNA/DNA]
+# Dinucleotides of the RNA strand, written with T instead of U.
+tt_rna_dna = {
+	#				 dH0	 dS0 	 dG0
+	'AA'		:	(-7.8,	-21.9,	-1.0),
+	'AC'		:	(-5.9,	-12.3,	-2.1),
+	'AG'		:	(-9.1,	-23.5,	-1.8),
+	'AT'		:	(-8.3,	-23.9,	-0.9),
+	'CA'		:	(-9.0,	-26.1,	-0.9),
+	'CC'		:	(-9.3,	-23.2,	-2.1),
+	'CG'		:	(-16.3,	-47.1,	-1.7),
+	'CT'		:	(-7.0,	-19.7,	-0.9),
+	'GA'		:	(-5.5,	-13.5,	-1.3),
+	'GC'		:	(-8.0,	-17.1,	-2.7),
+	'GG'		:	(-12.8,	-31.9,	-2.9),
+	'GT'		:	(-7.8,	-21.6,	-1.1),
+	'TA'		:	(-7.8,	-23.2,	-0.6),
+	'TC'		:	(-8.6,	-22.9,	-1.5),
+	'TG'		:	(-10.4,	-28.4,	-1.6),
+	'TT'		:	(-11.5,	-36.4,	-0.2),
+	'init'		:	(1.9,	-3.9,	3.1),
+	'has_init'	:	True,
+	'has_end'	:	False,
+	'has_sym'	:	False
+}
+
+def compile_model(table):
+	'''
+	Args:
+		table (dict): nearest-neighbour table, in the format of tt.
+
+	Return:
+		dict: the table as dense arrays, by nucleotide code.
+	'''
 
-# Add script description
-parser = argparse.ArgumentParser(
-	description = 'Characterize k-mers from fasta file without headers.'
-)
-
-# Add mandatory arguments
-parser.add_argument('fastaInput', type = str, nargs = 1,
-	help = 'Path to input fasta file.')
-parser.add_argument('output', type = str, nargs = 1,
-	help = 'Path to output tsv file.')
-
-# Add arguments with default value
-parser.add_argument('-o', '--oligoconc', type = int, nargs = 1,
-	metavar = 'oligoConc', help = """
-	Oligo molar concentration. Default: 0.25e-6
-	""", default = [0.25e-6])
-parser.add_argument('-l', '--hplen', type = int, nargs = 1,
-	metavar = 'hplen', help = """
-	Homopolymer stretch length in nt. Default: 4 nt
-	""", default = [4])
-
-# Parse arguments
-args = parser.parse_args()
-
-# Assign to in-script variables
-fain = args.fastaInput[0]
-out = args.output[0]
-oligo_conc = args.oligoconc[0]
-hp_len = args.hplen[0]
+	model = dict((key, table.get(key, False))
+		for key in ('has_end', 'has_init', 'has_sym'))
+	model['nn_dh'] = np.array([[table[a + b][0] for b in NT] for a in NT])
+	model['nn_ds'] = np.array([[table[a + b][1] for b in NT] for a in NT])
+	if model['has_end']:
+		model['end_dh'] = np.array([table['end' + a][0] for a in NT])
+		model['end_ds'] = np.array([table['end' + a][1] for a in NT])
+	if model['has_init']:
+		model['init'] = table['init'][:2]
+	if model['has_sym']:
+		model['sym'] = table['sym'][:2]
+	return(model)
+
+# Registry of nearest-neighbour models, for additional Tm variants
+MODELS = {
+	'dna' : compile_model(tt),
+	'rna_dna' : compile_model(tt_rna_dna)
+}
+
+# Same tables, in exact integer tenths, for rolling sums
+NN_DH10 = np.rint(NN_DH * 10).astype(np.int64)
+NN_DS10 = np.rint(NN_DS * 10).astype(np.int64)
+END_DH10 = np.rint(END_DH * 10).astype(np.int64)
+END_DS10 = np.rint(END_DS * 10).astype(np.int64)
 
 # FUNCTIONS ====================================================================
 
-def file_nrow(fname):
-    with open(fname) as f:
-        for i, l in enumerate(f):
-            pass
-    return(i + 1)
-
 def rc(na, t):
 	'''
 	Args:
@@ -66,43 +264,14 @@ def rc(na, t):
 		t (string): nucleic acid type, either 'dna' or 'rna'.
 
 	Return:
-		string: reverse complement of na.
+		string: reverse complement of na, upper case.
 	'''
 
-	# Identify type
-	t = t.lower()
-
-	# Select alphabet
-	if t == 'dna':
-		ab = ["ATCG", "TAGC"]
-	elif t == 'rna':
-		ab = ["AUCG", "UAGC"]
-	else:
-		print('ERROR: unknown na type.')
-		return()
-
-	rab = ab[1].strip().lower()
-	ab = ab[0].strip().lower()
-
-	# Check provided string
-	na = na.lower()
-
-	for c in na:
-		if not c in ab:
-			print('ERROR: provided string conflicts with selected alphabet.')
-			return()
-
-	# Calculate reverse
-	r = na[::-1]
-
-	# Calculate reverse complement
-	rc = []
-	for c in r:
-		rc.append(rab[ab.index(c)])
-
-	rc=''.join([str(c) for c in rc]).upper()
-
-	return(rc)
+	try:
+		return(revcomp(na.upper(), t))
+	except ValueError as e:
+		print('ERROR: %s' % (e,))
+		return(())
 
 def has_hp(seq, k):
 	''''''
@@ -119,42 +288,6 @@ def has_hp(seq, k):
 
 
 def characterize(seq, oligo_conc, hp_len):
-	# DEFAULT ------------------------------------------------------------------
-	
-	# Gas constant
-	R = 1.987 / 1000	# kcal / (K mol)
-
-	# Table from Allawi&Santalucia, Biochemistry(36), 1997 - in 1 M NaCl [DNA]
-	# dH0: kcal / mol
-	# dS0: eu = cal / (K mol)
-	# dG0: kcal / mol
-	tt = {
-		#				 dH0	 dS0 	 dG0
-		'AA'		:	(-7.9,	-22.2,	-1.0),
-		'TT'		:	(-7.9,	-22.2,	-1.0),
-		'AT'		:	(-7.2,	-20.4,	-0.88),
-		'TA'		:	(-7.2,	-21.3,	-0.58),
-		'CA'		:	(-8.5,	-22.7,	-1.45),
-		'TG'		:	(-8.5,	-22.7,	-1.45),
-		'GT'		:	(-8.4,	-22.4,	-1.44),
-		'AC'		:	(-8.4,	-22.4,	-1.44),
-		'CT'		:	(-7.8,	-21.0,	-1.28),
-		'AG'		:	(-7.8,	-21.0,	-1.28),
-		'GA'		:	(-8.2,	-22.2,	-1.3),
-		'TC'		:	(-8.2,	-22.2,	-1.3),
-		'CG'		:	(-10.6,	-27.2,	-2.17),
-		'GC'		:	(-9.8,	-24.4,	-2.24),
-		'GG'		:	(-8.0,	-19.9,	-1.84),
-		'CC'		:	(-8.0,	-19.9,	-1.84),
-		'endG'		:	(.1,	-2.8,	.98),
-		'endC'		:	(.1,	-2.8,	.98),
-		'endA'		:	(2.3,	4.1,	1.03),
-		'endT'		:	(2.3,	4.1,	1.03),
-		'has_end'	:	True,
-		'sym'		:	(2.3,	4.1,	1.03),
-		'has_sym'	:	True
-	}
-
 	# GC content ---------------------------------------------------------------
 
 	# Calculate GC content
@@ -174,7 +307,8 @@ def characterize(seq, oligo_conc, hp_len):
 		h += tt['end%s' % (seq[-1],)][0]
 
 	# Correct enthalpy for symmetry
-	if tt['has_sym'] and seq == rc(seq, 'dna'):
+	sym = tt['has_sym'] and is_palindrome(seq)
+	if sym:
 		h += tt['sym'][0]
 
 	# Calculate dS0(N-N) in kcal / (K mol)
@@ -186,7 +320,7 @@ def characterize(seq, oligo_conc, hp_len):
 		s += tt['end%s' % (seq[-1],)][1]
 
 	# Correct enthalpy for symmetry
-	if tt['has_sym'] and seq == rc(seq, 'dna'):
+	if sym:
 		s += tt['sym'][1]
 
 	s /= 1e3
@@ -200,28 +334,639 @@ def characterize(seq, oligo_conc, hp_len):
 	# Output -------------------------------------------------------------------
 	return((fgc, Tm1 - 273.15, hp))
 
+class OligoCache(object):
+	'''Bounded LRU cache of oligo properties, keyed by 2-bit packed sequence.'''
+
+	def __init__(self, size, oligo_conc, hp_len):
+		'''
+		Args:
+			size (int): maximum number of cached oligos.
+			oligo_conc (float): oligo molar concentration.
+			hp_len (int): homopolymer stretch length in nt.
+		'''
+
+		self.size = size
+		self.oligo_conc = oligo_conc
+		self.hp_len = hp_len
+		self.data = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def characterize(self, M):
+		'''
+		Same as characterize_matrix, computing only distinct oligos missing
+		from the cache, and expanding the results to every row.
+
+		Args:
+			M (np.ndarray): oligos of the same length, one per row, as packed_seq
+				nucleotide codes.
+
+		Return:
+			tuple: (fgc, tm, hp) arrays, one value per row.
+		'''
+
+		(n, L) = M.shape
+		if L > MAX_PACKED_LEN:
+			return(characterize_matrix(M, self.oligo_conc, self.hp_len))
+
+		# Distinct oligos in the batch
+		(keys, first, inverse) = np.unique(pack_2bit(M),
+			return_index = True, return_inverse = True)
+		fgc = np.zeros(len(keys))
+		tm = np.zeros(len(keys))
+		hp = np.zeros(len(keys), dtype = np.int64)
+
+		# Look up
+		missing = []
+		for (i, key) in enumerate(keys.tolist()):
+			value = self.data.get((L, key))
+			if value is None:
+				missing.append(i)
+			else:
+				self.data.move_to_end((L, key))
+				(fgc[i], tm[i], hp[i]) = value
+		self.hits += n - len(missing)
+		self.misses += len(missing)
+
+		# Characterize and store the missing ones
+		if 0 != len(missing):
+			missing = np.array(missing)
+			(fgc[missing], tm[missing], hp[missing]) = characterize_matrix(
+				M[first[missing]], self.oligo_conc, self.hp_len)
+			for i in missing.tolist():
+				self.data[(L, int(keys[i]))] = (fgc[i], tm[i], hp[i])
+			while len(self.data) > self.size:
+				self.data.popitem(last = False)
+
+		inverse = inverse.reshape(-1)
+		return((fgc[inverse], tm[inverse], hp[inverse]))
+
+class OligoStore(object):
+	'''Persistent SQLite store of oligo properties, keyed by 2-bit packed
+	sequence. Only concentration-independent properties are stored.'''
+
+	def __init__(self, path, oligo_conc, hp_len):
+		'''
+		Args:
+			path (string): path to SQLite database, created if missing.
+			oligo_conc (float): oligo molar concentration.
+			hp_len (int): homopolymer stretch length in nt.
+		'''
+
+		self.oligo_conc = oligo_conc
+		self.hp_len = hp_len
+		self.hits = 0
+		self.misses = 0
+
+		self.db = sqlite3.connect(path, timeout = 600)
+		self.db.execute('PRAGMA journal_mode = WAL')
+		self.db.execute('''CREATE TABLE IF NOT EXISTS oligo (
+			len INTEGER, key INTEGER, ngc INTEGER, dh REAL, ds REAL,
+			hprun INTEGER, PRIMARY KEY (len, key)) WITHOUT ROWID''')
+		self.db.execute('CREATE TEMP TABLE query (key INTEGER PRIMARY KEY)')
+		self.db.commit()
+
+	def lookup(self, M):
+		'''
+		Same as thermo_matrix, computing and storing only distinct oligos
+		missing from the store.
+
+		Args:
+			M (np.ndarray): oligos of the same length, one per row, as packed_seq
+				nucleotide codes.
+
+		Return:
+			tuple: (ngc, h, s, hprun) arrays, one value per row.
+		'''
+
+		(n, L) = M.shape
+		if L > MAX_PACKED_LEN:
+			return(thermo_matrix(M))
+
+		# Distinct oligos in the batch, as signed SQLite integers
+		(keys, first, inverse) = np.unique(pack_2bit(M),
+			return_index = True, return_inverse = True)
+		skeys = keys.view(np.int64)
+		ngc = np.zeros(len(keys), dtype = np.int64)
+		h = np.zeros(len(keys))
+		s = np.zeros(len(keys))
+		hprun = np.zeros(len(keys), dtype = np.int64)
+		found = np.zeros(len(keys), dtype = bool)
+
+		# Look up
+		self.db.execute('DELETE FROM query')
+		self.db.executemany('INSERT INTO query VALUES (?)',
+			((key,) for key in skeys.tolist()))
+		rows = self.db.execute('''SELECT o.key, o.ngc, o.dh, o.ds, o.hprun
+			FROM query AS q JOIN oligo AS o ON o.len = ? AND o.key = q.key''',
+			(int(L),)).fetchall()
+		self.db.commit()
+		if 0 != len(rows):
+			cols = list(zip(*rows))
+			idx = np.searchsorted(keys,
+				np.array(cols[0], dtype = np.int64).view(np.uint64))
+			(ngc[idx], h[idx], s[idx], hprun[idx]) = cols[1:]
+			found[idx] = True
+
+		# Compute and store the missing ones, in a new write transaction so
+		# that concurrent writers wait for each other
+		missing = np.flatnonzero(~found)
+		self.hits += n - len(missing)
+		self.misses += len(missing)
+		if 0 != len(missing):
+			(ngc[missing], h[missing], s[missing], hprun[missing]) = thermo_matrix(
+				M[first[missing]])
+			self.db.executemany(
+				'INSERT OR IGNORE INTO oligo VALUES (?, ?, ?, ?, ?, ?)',
+				zip([int(L)] * len(missing), skeys[missing].tolist(),
+				ngc[missing].tolist(), h[missing].tolist(), s[missing].tolist(),
+				hprun[missing].tolist()))
+		self.db.commit()
+
+		inverse = inverse.reshape(-1)
+		return((ngc[inverse], h[inverse], s[inverse], hprun[inverse]))
+
+	def characterize(self, M):
+		'''
+		Same as characterize_matrix, with properties from the store.
+
+		Args:
+			M (np.ndarray): oligos of the same length, one per row, as packed_seq
+				nucleotide codes.
+
+		Return:
+			tuple: (fgc, tm, hp) arrays, one value per row.
+		'''
+
+		return(derive_properties(M.shape[1], *self.lookup(M),
+			oligo_conc = self.oligo_conc, hp_len = self.hp_len))
+
+	def close(self):
+		self.db.close()
+
+def characterize_batch(seqs, oligo_conc, hp_len, cache = None):
+	'''
+	Characterize many oligos at once, with the same output as characterize.
+	Sequences are encoded into a matrix per sequence length, and the
+	nearest-neighbour contributions are looked up for all the oligos at once.
+
+	Args:
+		seqs (list): upper-case sequences, with A, C, G and T only.
+		oligo_conc (float): oligo molar concentration.
+		hp_len (int): homopolymer stretch length in nt.
+		cache (OligoCache): optional cache or store, with the same settings.
+
+	Return:
+		tuple: (fgc, tm, hp) arrays, in the order of seqs.
+	'''
+
+	n = len(seqs)
+	fgc = np.zeros(n)
+	tm = np.zeros(n)
+	hp = np.zeros(n, dtype = np.int64)
+
+	# Group sequences by length
+	lens = np.array([len(seq) for seq in seqs])
+	for L in np.unique(lens):
+		rows = np.flatnonzero(lens == L)
+		M = encode(''.join([seqs[i] for i in rows])).reshape(len(rows), L)
+		if (M == MASK).any():
+			bad = rows[(M == MASK).any(1)][0]
+			raise ValueError("Unexpected nucleotide in '%s'." % (seqs[bad],))
+
+		if cache is None:
+			(fgc[rows], tm[rows], hp[rows]) = characterize_matrix(M,
+				oligo_conc, hp_len)
+		else:
+			(fgc[rows], tm[rows], hp[rows]) = cache.characterize(M)
+
+	return((fgc, tm, hp))
+
+def parse_tm_variant(spec):
+	'''
+	Args:
+		spec (string): Tm variant, as MODEL[,na=M][,fa=PERC].
+
+	Return:
+		tuple: (model name, Na+ molar concentration or None, formamide %).
+	'''
+
+	fields = spec.split(',')
+	if not fields[0] in MODELS:
+		raise ValueError("Unknown model '%s'. Available: %s." % (fields[0],
+			", ".join(sorted(MODELS.keys()))))
+	opts = {'na' : None, 'fa' : 0.}
+	for field in fields[1:]:
+		(key, sep, value) = field.partition('=')
+		if not key in opts or '' == sep:
+			raise ValueError("Unknown variant setting '%s'." % (field,))
+		opts[key] = float(value)
+	if not opts['na'] is None and 0 >= opts['na']:
+		raise ValueError("Na+ concentration must be greater than 0.")
+	return((fields[0], opts['na'], opts['fa']))
+
+def nn_sums(M, model):
+	'''
+	Args:
+		M (np.ndarray): oligos of the same length, one per row, as packed_seq
+			nucleotide codes.
+		model (dict): compiled model, from compile_model.
+
+	Return:
+		tuple: (h, s) arrays, enthalpy (kcal / mol) and entropy
+		(cal / (K mol)) at 1 M NaCl.
+	'''
+
+	(n, L) = M.shape
+
+	# Summed in the same order as characterize
+	h = np.zeros(n)
+	s = np.zeros(n)
+	for j in range(L - 1):
+		h += model['nn_dh'][M[:, j], M[:, j + 1]]
+		s += model['nn_ds'][M[:, j], M[:, j + 1]]
+	if model['has_end']:
+		h += model['end_dh'][M[:, 0]]
+		h += model['end_dh'][M[:, -1]]
+		s += model['end_ds'][M[:, 0]]
+		s += model['end_ds'][M[:, -1]]
+	if model['has_init']:
+		h += model['init'][0]
+		s += model['init'][1]
+	if model['has_sym']:
+		sym = is_palindrome_codes(M)
+		h[sym] += model['sym'][0]
+		s[sym] += model['sym'][1]
+
+	return((h, s))
+
+def tm_variants(M, variants, oligo_conc):
+	'''
+	Args:
+		M (np.ndarray): oligos of the same length, one per row, as packed_seq
+			nucleotide codes.
+		variants (list): Tm variants, from parse_tm_variant.
+		oligo_conc (float): oligo molar concentration.
+
+	Return:
+		list: one array of Tm in Celsius per variant.
+	'''
+
+	L = M.shape[1]
+
+	# Nearest-neighbour sums, once per model
+	sums = dict((name, nn_sums(M, MODELS[name]))
+		for name in set(v[0] for v in variants))
+
+	tms = []
+	for (name, na, fa) in variants:
+		(h, s) = sums[name]
+		if not na is None:
+			s = s + .368 * (L - 1) * math.log(na)
+		tms.append(h / (s / 1e3 + R * math.log(oligo_conc)) - 273.15 - .63 * fa)
+	return(tms)
+
+def tm_batch(seqs, variants, oligo_conc):
+	'''
+	Args:
+		seqs (list): upper-case sequences, with A, C, G and T only.
+		variants (list): Tm variants, from parse_tm_variant.
+		oligo_conc (float): oligo molar concentration.
+
+	Return:
+		list: one array of Tm in Celsius per variant, in the order of seqs.
+	'''
+
+	tms = [np.zeros(len(seqs)) for v in variants]
+	lens = np.array([len(seq) for seq in seqs])
+	for L in np.unique(lens):
+		rows = np.flatnonzero(lens == L)
+		M = encode(''.join([seqs[i] for i in rows])).reshape(len(rows), L)
+		for (tm, tmv) in zip(tms, tm_variants(M, variants, oligo_conc)):
+			tm[rows] = tmv
+	return(tms)
+
+def characterize_matrix(M, oligo_conc, hp_len):
+	'''
+	Args:
+		M (np.ndarray): oligos of the same length, one per row, as packed_seq
+			nucleotide codes.
+		oligo_conc (float): oligo molar concentration.
+		hp_len (int): homopolymer stretch length in nt.
+
+	Return:
+		tuple: (fgc, tm, hp) arrays, one value per row.
+	'''
+
+	return(derive_properties(M.shape[1], *thermo_matrix(M),
+		oligo_conc = oligo_conc, hp_len = hp_len))
+
+def thermo_matrix(M):
+	'''
+	Concentration-independent properties of oligos of the same length.
+
+	Args:
+		M (np.ndarray): oligos of the same length, one per row, as packed_seq
+			nucleotide codes.
+
+	Return:
+		tuple: (ngc, h, s, hprun) arrays, one value per row. GC count,
+		enthalpy (kcal / mol), entropy (cal / (K mol)) and longest
+		homopolymer stretch in nt.
+	'''
+
+	(n, L) = M.shape
+
+	# GC count
+	ngc = ((M == 1) | (M == 2)).sum(1)
+
+	# Enthalpy and entropy
+	(h, s) = nn_sums(M, MODELS['dna'])
+
+	# Longest run of identical neighbour pairs, as in has_hp
+	c = np.zeros(n, dtype = np.int64)
+	hprun = np.zeros(n, dtype = np.int64)
+	for j in range(L - 1):
+		c = (c + 1) * (M[:, j] == M[:, j + 1])
+		hprun = np.maximum(hprun, c)
+
+	return((ngc, h, s, hprun + 1))
+
+def derive_properties(L, ngc, h, s, hprun, oligo_conc, hp_len):
+	'''
+	Args:
+		L (int): oligo length in nt.
+		ngc, h, s, hprun (np.ndarray): output of thermo_matrix.
+		oligo_conc (float): oligo molar concentration.
+		hp_len (int): homopolymer stretch length in nt.
+
+	Return:
+		tuple: (fgc, tm, hp) arrays, as characterize_matrix.
+	'''
+
+	# GC content
+	fgc = ngc / float(L)
+
+	# Melting temperature in Celsius
+	tm = h / (s / 1e3 + R * math.log(oligo_conc)) - 273.15
+
+	# Homopolymer, as in has_hp
+	hp = (1 < L) & (hprun - 1 >= hp_len)
+
+	return((fgc, tm, hp.astype(np.int64)))
+
+def characterize_rolling(seq, k, oligo_conc, hp_len):
+	'''
+	Characterize every k-mer of a sequence, with a rolling window. GC count,
+	enthalpy, entropy and homopolymer stretches are tracked with prefix
+	sums, so that every window costs O(1) regardless of k. Windows
+	overlapping Ns are skipped from the N regions, and never computed. Sums
+	are exact, in tenths of the table units, and values match characterize
+	up to the last digits of floating point precision.
+
+	Args:
+		seq (string): upper-case sequence.
+		k (int): oligo length in nt.
+		oligo_conc (float): oligo molar concentration.
+		hp_len (int): homopolymer stretch length in nt.
+
+	Return:
+		tuple: (pos, fgc, tm, hp) arrays, for the k-mers without Ns, and the
+		N regions from skipped_regions. pos is the 0-indexed k-mer position
+		in seq.
+	'''
+
+	codes = encode(seq)
+	regions = skipped_regions(codes, k)
+
+	n = len(seq) - k + 1
+	if 0 >= n:
+		return(tuple(np.zeros(0, dtype = t)
+			for t in (np.int64, float, float, np.int64)) + (regions,))
+
+	# Skip windows with Ns
+	start = clean_kmer_positions(*regions[:2], len(codes), k)
+	codes = np.where(codes == MASK, 0, codes)
+	stop = start + k
+
+	def window_sum(x, lo, hi):
+		'''Sum of x[lo:hi] for every window, from the prefix sums of x.'''
+		cx = np.concatenate([[0], np.cumsum(x)])
+		return(cx[hi] - cx[lo])
+
+	# GC content
+	fgc = window_sum((codes == 1) | (codes == 2), start, stop) / float(k)
+
+	# Enthalpy and entropy, in tenths
+	h = window_sum(NN_DH10[codes[:-1], codes[1:]], start, stop - 1)
+	s = window_sum(NN_DS10[codes[:-1], codes[1:]], start, stop - 1)
+	if tt['has_end']:
+		h += END_DH10[codes[start]] + END_DH10[codes[stop - 1]]
+		s += END_DS10[codes[start]] + END_DS10[codes[stop - 1]]
+	if tt['has_sym'] and 0 == k % 2:
+		# Narrow down palindromic candidates from the outside in
+		sym = start.copy()
+		for m in range(k // 2):
+			sym = sym[codes[sym + m] == 3 - codes[sym + k - 1 - m]]
+		h[sym] += int(round(tt['sym'][0] * 10))
+		s[sym] += int(round(tt['sym'][1] * 10))
+
+	# Melting temperature in Celsius
+	tm = (h / 10.) / (s / 10. / 1e3 + R * math.log(oligo_conc)) - 273.15
+
+	# Homopolymer, as in has_hp: runs of hp_len identical neighbour pairs
+	eq = codes[:-1] == codes[1:]
+	j = np.arange(len(eq))
+	last_diff = np.maximum.accumulate(np.where(eq, -1, j))
+	run_end = (j - last_diff) >= hp_len
+	lo = np.minimum(start + max(hp_len - 1, 0), stop - 1)
+	hp = (0 != window_sum(run_end, lo, stop - 1)).astype(np.int64)
+
+	return((start, fgc, tm, hp, regions))
+
+def format_batch(seqs, oligo_conc, hp_len, cache = None, variants = ()):
+	'''Characterize a batch of oligos and format it as TSV rows, with one
+	extra column per Tm variant.'''
+	if 0 == len(seqs):
+		return("")
+	(fgc, tm, hp) = characterize_batch(seqs, oligo_conc, hp_len, cache)
+	if 0 == len(variants):
+		return("".join(["%s\t%f\t%f\t%d\n" % row
+			for row in zip(seqs, fgc.tolist(), tm.tolist(), hp.tolist())]))
+
+	fmt = "%s\t%f\t%f\t%d" + "\t%f" * len(variants) + "\n"
+	return("".join([fmt % row for row in zip(seqs, fgc.tolist(), tm.tolist(),
+		hp.tolist(), *[t.tolist() for t in tm_batch(seqs, variants,
+		oligo_conc)])]))
+
+def line_chunks(fname, chunk_bytes):
+	'''
+	Args:
+		fname (string): path to input file.
+		chunk_bytes (int): approximate chunk size in bytes.
+
+	Return:
+		list: (start, end) byte ranges, each ending at a line end.
+	'''
+
+	size = os.path.getsize(fname)
+	chunks = []
+	with open(fname, 'rb') as f:
+		start = 0
+		while start < size:
+			f.seek(min(start + chunk_bytes, size))
+			f.readline()
+			end = min(f.tell(), size)
+			chunks.append((start, end))
+			start = end
+	return(chunks)
+
+def characterize_chunk(chunk, fain, oligo_conc, hp_len, batch_size,
+	cache_size = 0, store_path = None, variants = ()):
+	'''
+	Characterize the lines of a byte range of the input. The oligo cache, or
+	store connection, of the worker process is kept across chunks.
+
+	Args:
+		chunk (tuple): (start, end) byte range, from line_chunks.
+		fain (string): path to input file.
+		oligo_conc (float): oligo molar concentration.
+		hp_len (int): homopolymer stretch length in nt.
+		batch_size (int): number of oligos characterized at once.
+		cache_size (int): maximum number of cached oligos, 0 to disable.
+		store_path (string): path to persistent oligo store, or None.
+		variants (list): additional Tm variants, from parse_tm_variant.
+
+	Return:
+		tuple: (TSV rows, number of lines, number of skipped lines, and
+		list of (line index in chunk, line length) of the skipped lines).
+	'''
+
+	global WORKER_CACHE
+	if WORKER_CACHE is None:
+		if not store_path is None:
+			WORKER_CACHE = OligoStore(store_path, oligo_conc, hp_len)
+		elif 0 < cache_size:
+			WORKER_CACHE = OligoCache(cache_size, oligo_conc, hp_len)
+
+	(start, end) = chunk
+	with open(fain, 'rb') as f:
+		f.seek(start)
+		lines = f.read(end - start).decode().splitlines()
+
+	rows = []
+	skipped = []
+	for a in range(0, len(lines), batch_size):
+		batch = []
+		for (i, line) in enumerate(lines[a:(a + batch_size)], a):
+			if 0 != line.count('N'):
+				skipped.append((i, len(line.strip())))
+				continue
+			batch.append(line.upper().strip())
+		rows.append(format_batch(batch, oligo_conc, hp_len, WORKER_CACHE,
+			variants))
+
+	return(("".join(rows), len(lines), len(skipped), skipped))
+
 # RUN ==========================================================================
 
-bar = progressbar.ProgressBar(max_value = file_nrow(fain))
-fout = open(out, 'w+')
-with open(fain, 'r') as fin:
-	i = 0
-	bar.update(i)
-	j = 0
-	for line in fin:
-		i += 1
-		if 0 != line.count('N'):
-			j += 1
-			continue
-		line = line.upper().strip()
-		(fgc, tm, hp) = characterize(line, oligo_conc, hp_len)
-		fout.write("%s\t%f\t%f\t%d\n" % (line, fgc, tm, hp))
-		bar.update(i)
-fout.close()
-fin.close()
-
-print("Skipped %d (out of %d) sequences containing Ns." % (j, i+j,))
-
-# END ==========================================================================
+if __name__ == '__main__':
+
+	# Parse arguments
+	args = parse_arguments()
+
+	# Assign to in-script variables
+	fain = args.fastaInput[0]
+	out = args.output[0]
+	oligo_conc = args.oligoconc[0]
+	hp_len = args.hplen[0]
+	no_progress = args.no_progress
+	batch_size = args.batch[0]
+	threads = max(1, args.threads[0])
+	k = args.rolling[0]
+	cache_size = args.cache[0]
+	variants = args.tm_model
+	store_path = args.store[0]
+	skipped = args.skipped[0]
+	fskip = None if skipped is None else open(skipped, 'w')
+	if not store_path is None:
+		cache = OligoStore(store_path, oligo_conc, hp_len)
+	elif 0 < cache_size:
+		cache = OligoCache(cache_size, oligo_conc, hp_len)
+	else:
+		cache = None
+
+	fout = xopen(out, 'w')
+	with xopen(fain, 'r') as fin:
+		bar = FileProgress(fin, no_progress)
+		i = 0
+		j = 0
+		batch = []
+
+		if not k is None:
+			# Characterize every k-mer of every sequence
+			bar.every = 1
+			for (curr_id, seq) in fasta_records(fin):
+				seq = seq.upper()
+				(pos, fgc, tm, hp, regions) = characterize_rolling(seq, k,
+					oligo_conc, hp_len)
+				n = max(0, len(seq) - k + 1)
+				i += n
+				j += n - len(pos)
+				if not fskip is None:
+					fskip.write(format_skipped(curr_id, k, *regions))
+				fout.write("".join(["%s_O%d\t%s\t%f\t%f\t%d\n" % (curr_id, p,
+					seq[p:(p + k)], g, t, h) for (p, g, t, h) in zip(
+					pos.tolist(), fgc.tolist(), tm.tolist(), hp.tolist())]))
+				bar.update()
+		elif 1 < threads:
+			# Characterize chunks in parallel, write them in order
+			chunks = line_chunks(fain, CHUNK_BYTES)
+			worker = partial(characterize_chunk, fain = fain,
+				oligo_conc = oligo_conc, hp_len = hp_len, batch_size = batch_size,
+				cache_size = cache_size, store_path = store_path,
+				variants = variants)
+			with ProcessPoolExecutor(max_workers = threads,
+				mp_context = multiprocessing.get_context('fork')) as pool:
+				for ((start, end), (rows, n, nskip, lskip)) in zip(chunks,
+					pool.map(worker, chunks)):
+					fout.write(rows)
+					if not fskip is None:
+						fskip.write("".join(["%s\t%d\t%d\t%dmer\t1\n" % (fain,
+							i + l, i + l + 1, L) for (l, L) in lskip]))
+					i += n
+					j += nskip
+					bar.update(n, end)
+		else:
+			for line in fin:
+				bar.update()
+				i += 1
+				if 0 != line.count('N'):
+					if not fskip is None:
+						fskip.write("%s\t%d\t%d\t%dmer\t1\n" % (fain, i - 1, i,
+							len(line.strip())))
+					j += 1
+					continue
+				batch.append(line.upper().strip())
+
+				if len(batch) >= batch_size:
+					fout.write(format_batch(batch, oligo_conc, hp_len, cache,
+						variants))
+					batch = []
+			fout.write(format_batch(batch, oligo_conc, hp_len, cache, variants))
+		bar.finish()
+	fout.close()
+	fin.close()
+	if not fskip is None:
+		fskip.close()
+
+	print("Skipped %d (out of %d) sequences containing Ns." % (j, i,))
+	if not cache is None and 0 != cache.hits + cache.misses:
+		print("%s: %d distinct oligos characterized, %d reused." % (
+			"Cache" if store_path is None else "Store", cache.misses, cache.hits))
+	if not store_path is None:
+		cache.close()
+
+	# END ======================================================================
 
 ################################################################################
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# ------------------------------------------------------------------------------
+# 
+# Author: Gabriele Girelli
+# Email: gigi.ga90@gmail.com
+# Version: 1.0.1
+# Date: 20170724
+# Project: 680 genes
+# Description:	transparent compressed readers and writers, by extension.
+# 
+# Notes:
+# 		Supported extensions: .gz (gzip), .bgz (bgzip, BGZF blocks) and .zst
+# 		or .zstd (zstd). Any other path is opened as a plain file.
+# 		Compressed input is decompressed by a background thread, in chunks
+# 		queued to the reader, so that parsing and decompression overlap.
+# 		zstd uses the zstandard module if available, otherwise the zstd
+# 		command line tool, in a separate process.
+# 		Compressed streams opened for reading have a compressed_fileno
+# 		attribute, to track progress on the compressed file offset.
+# 		blast-filter/compressed_io.py is a symbolic link to this file.
+# 
+# Changelog:
+# 		1.0.0: first implementation.
+# 		1.0.1: single copy, shared with blast-filter.
+# 
+# ------------------------------------------------------------------------------
+
+
+
+# DEPENDENCIES =================================================================
+
+import gzip
+import io
+import os
+import queue
+import shutil
+import struct
+import subprocess
+import threading
+import zlib
+from functools import partial
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+# PARAMETERS ===================================================================
+
+# Compression format per extension
+COMPRESSION_EXT = {
+	'.gz' : 'gzip',
+	'.bgz' : 'bgzip',
+	'.zst' : 'zstd',
+	'.zstd' : 'zstd'
+}
+
+# Decompressed chunk size, and number of chunks queued by the reader thread
+READ_CHUNK = 1024 * 1024
+READ_DEPTH = 8
+
+# gzip and zstd compression levels
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# BGZF block payload size, and end-of-file marker block
+BGZF_BLOCK = 0xff00
+BGZF_EOF = bytes.fromhex(
+	'1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+# FUNCTIONS ====================================================================
+
+def split_compression_ext(path):
+	'''
+	Args:
+		path (string): file path.
+
+	Return:
+		tuple: (path without compression extension, compression extension or
+		empty string).
+	'''
+	(root, ext) = os.path.splitext(path)
+	if ext in COMPRESSION_EXT:
+		return((root, ext))
+	return((path, ''))
+
+def compression(path):
+	'''
+	Args:
+		path (string): file path.
+
+	Return:
+		string: compression format of path, by extension, or None.
+	'''
+	return(COMPRESSION_EXT.get(split_compression_ext(path)[1], None))
+
+def zstd_command():
+	'''Path to the zstd command line tool, raises an error if missing.'''
+	cmd = shutil.which('zstd')
+	if cmd is None:
+		raise RuntimeError("zstd support requires the zstandard module, " +
+			"or the zstd command line tool.")
+	return(cmd)
+
+def close_process(proc, raw):
+	'''
+	Stop a decompressing process, and close the file it reads.
+
+	Args:
+		proc (Popen): decompressing process.
+		raw (file): open binary input file of proc.
+	'''
+	proc.kill()
+	proc.wait()
+	raw.close()
+
+class ThreadedReader(io.RawIOBase):
+	'''Raw binary stream, filled by a background decompressing thread.'''
+
+	def __init__(self, source, on_close = None):
+		'''
+		Args:
+			source (file): binary stream of decompressed data.
+			on_close (function): called once the source is consumed, or
+				abandoned, on close.
+		'''
+
+		self.source = source
+		self.on_close = on_close
+		self.queue = queue.Queue(READ_DEPTH)
+		self.pending = memoryview(b'')
+		self.eof = False
+		self.error = None
+		self.stop = False
+
+		self.thread = threading.Thread(target = self._fill, daemon = True)
+		self.thread.start()
+
+	def _fill(self):
+		'''Decompress chunks into the queue, an empty chunk at the end.'''
+		try:
+			while not self.stop:
+				data = self.source.read(READ_CHUNK)
+				self.queue.put(data)
+				if not data:
+					return
+		except Exception as e:
+			self.error = e
+		self.queue.put(b'')
+
+	def readable(self):
+		return(True)
+
+	def readinto(self, b):
+		while 0 == len(self.pending):
+			if self.eof:
+				return(0)
+			data = self.queue.get()
+			if not data:
+				self.eof = True
+				if not self.error is None:
+					raise self.error
+				return(0)
+			self.pending = memoryview(data)
+
+		n = min(len(b), len(self.pending))
+		b[:n] = self.pending[:n]
+		self.pending = self.pending[n:]
+		return(n)
+
+	def close(self):
+		if not self.closed:
+			# Unblock and wait for the reader thread
+			self.stop = True
+			while self.thread.is_alive():
+				try:
+					self.queue.get(timeout = .1)
+				except queue.Empty:
+					pass
+			self.source.close()
+			if not self.on_close is None:
+				self.on_close()
+		super(ThreadedReader, self).close()
+
+class PipeWriter(io.RawIOBase):
+	'''Raw binary stream, compressed by a command line tool.'''
+
+	def __init__(self, cmd, fout):
+		'''
+		Args:
+			cmd (list): compression command, reading from stdin and writing to
+				stdout.
+			fout (file): open binary output file.
+		'''
+		self.fout = fout
+		self.proc = subprocess.Popen(cmd, stdin = subprocess.PIPE,
+			stdout = fout)
+
+	def writable(self):
+		return(True)
+
+	def write(self, b):
+		self.proc.stdin.write(b)
+		return(len(b))
+
+	def close(self):
+		if not self.closed:
+			self.proc.stdin.close()
+			if 0 != self.proc.wait():
+				raise IOError("compression failed: %s" % (self.proc.args[0],))
+			self.fout.close()
+		super(PipeWriter, self).close()
+
+class BgzfWriter(io.RawIOBase):
+	'''Raw binary stream, compressed in BGZF blocks (bgzip).'''
+
+	def __init__(self, fout, level = GZIP_LEVEL):
+		'''
+		Args:
+			fout (file): open binary output file.
+			level (int): compression level.
+		'''
+		self.fout = fout
+		self.level = level
+		self.data = bytearray()
+
+	def writable(self):
+		return(True)
+
+	def _block(self, data):
+		'''Write one BGZF block.'''
+		c = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+		cdata = c.compress(data) + c.flush()
+		self.fout.write(struct.pack('<4BI2BH2BHH', 0x1f, 0x8b, 8, 4, 0, 0,
+			0xff, 6, ord('B'), ord('C'), 2, len(cdata) + 25))
+		self.fout.write(cdata)
+		self.fout.write(struct.pack('<II', zlib.crc32(data), len(data)))
+
+	def write(self, b):
+		self.data += b
+		while len(self.data) >= BGZF_BLOCK:
+			self._block(bytes(self.data[:BGZF_BLOCK]))
+			del self.data[:BGZF_BLOCK]
+		return(len(b))
+
+	def close(self):
+		if not self.closed:
+			if 0 != len(self.data):
+				self._block(bytes(self.data))
+			self.fout.write(BGZF_EOF)
+			self.fout.close()
+		super(BgzfWriter, self).close()
+
+def open_reader(path):
+	'''
+	Args:
+		path (string): path to compressed file.
+
+	Return:
+		ThreadedReader: decompressed binary stream.
+	'''
+
+	fmt = compression(path)
+	raw = open(path, 'rb')
+
+	if 'zstd' == fmt and zstandard is None:
+		# The zstd process reads the file, sharing its offset
+		proc = subprocess.Popen([zstd_command(), '-dcq'], stdin = raw,
+			stdout = subprocess.PIPE)
+		source = proc.stdout
+		on_close = partial(close_process, proc, raw)
+	elif 'zstd' == fmt:
+		source = zstandard.ZstdDecompressor().stream_reader(raw,
+			read_across_frames = True)
+		on_close = raw.close
+	else:
+		# gzip readers also read multi-member (BGZF) files
+		source = gzip.GzipFile(fileobj = raw, mode = 'rb')
+		on_close = raw.close
+
+	reader = ThreadedReader(source, on_close)
+	reader.compressed_fileno = raw.fileno()
+	return(reader)
+
+def open_writer(path, mode):
+	'''
+	Args:
+		path (string): path to compressed file.
+		mode (string): 'w' or 'a'.
+
+	Return:
+		file: raw binary stream, compressed on write.
+	'''
+
+	fmt = compression(path)
+	if 'gzip' == fmt:
+		return(gzip.open(path, mode + 'b', compresslevel = GZIP_LEVEL))
+
+	fout = open(path, mode + 'b')
+	if 'bgzip' == fmt:
+		return(BgzfWriter(fout))
+	if zstandard is None:
+		return(PipeWriter([zstd_command(), '-cq', '-%d' % (ZSTD_LEVEL,)], fout))
+	return(zstandard.ZstdCompressor(level = ZSTD_LEVEL).stream_writer(fout))
+
+def xopen(path, mode = 'r', buffering = -1):
+	'''
+	Open a plain or compressed file, by extension.
+
+	Args:
+		path (string): file path.
+		mode (string): 'r', 'w' or 'a', with optional 't' or 'b'.
+		buffering (int): buffer size, as in open.
+
+	Return:
+		file: open file object, text or binary as in open.
+	'''
+
+	if compression(path) is None:
+		return(open(path, mode, buffering))
+
+	binary = 'b' in mode
+	base = mode.replace('b', '').replace('t', '')
+	if 0 >= buffering:
+		buffering = io.DEFAULT_BUFFER_SIZE
+
+	if 'r' == base:
+		raw = open_reader(path)
+		f = io.BufferedReader(raw, buffering)
+	elif base in ('w', 'a'):
+		raw = open_writer(path, base)
+		f = io.BufferedWriter(raw, buffering)
+	else:
+		raise ValueError("invalid mode: '%s'" % (mode,))
+
+	if not binary:
+		f = io.TextIOWrapper(f)
+	if 'r' == base:
+		f.compressed_fileno = raw.compressed_fileno
+	return(f)
+
+# END ==========================================================================
+
+################################################################################
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# ------------------------------------------------------------------------------
+# 
+# Author: Gabriele Girelli
+# Email: gigi.ga90@gmail.com
+# Version: 1.3.0
+# Date: 20170724
+# Project: 680 genes
+# Description:	generate, characterize and filter oligos of length k from the
+# 				provided fasta file, in a single pass.
+# 
+# Note:
+# 	Equivalent to mk_oligos.py, followed by characterize_oligos.py and by the
+# 	GC/homopolymer awk filters of 01_prep.sh, without intermediate files.
+# 	The fasta file should have each sequence in one line.
+# 	Oligos containing Ns, or any other non-ACGT character, are skipped
+# 	without being generated, from the N regions of each sequence. With
+# 	--skipped, the regions are reported in a BED-like file.
+# 	Input and output can be compressed (.gz, .bgz, .zst), by extension.
+# 	Output headers are "> ID_O<i>:gc:tm:hp", as expected by blast_filter.
+# 
+# Changelog:
+# 		1.0.0: first implementation.
+# 		1.1.0: deduplicated characterization, with characterize_oligos cache.
+# 		1.2.0: k-mers overlapping Ns are not generated, skipped-region report.
+# 		1.3.0: compressed input and output.
+# 
+# ------------------------------------------------------------------------------
+
+
+
+# DEPENDENCIES =================================================================
+
+import argparse
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from characterize_oligos import OligoCache, characterize_matrix
+from compressed_io import xopen
+from mk_oligos import fasta_records
+from packed_seq import clean_kmer_positions, encode, format_skipped, \
+	skipped_regions
+from progress import FileProgress
+
+# PARAMETERS ===================================================================
+
+def parse_arguments():
+	'''Parse command line arguments.'''
+
+	# Add script description
+	parser = argparse.ArgumentParser(
+		description = 'Generate, characterize and filter k-mers from fasta file.'
+	)
+
+	# Add mandatory arguments
+	parser.add_argument('k', type = int, nargs = 1,
+		help = "Oligo length in nt.")
+	parser.add_argument('fastaInput', type = str, nargs = 1,
+		help = 'Path to input fasta file.')
+	parser.add_argument('fastaOutput', type = str, nargs = 1,
+		help = 'Path to output fasta file.')
+
+	# Add arguments with default value
+	parser.add_argument('-s', '--stride', type = int, nargs = 1,
+		metavar = 'stride', help = """
+		Step between consecutive k-mers, in nt. Default: 1""", default = [1])
+	parser.add_argument('-o', '--oligoconc', type = float, nargs = 1,
+		metavar = 'oligoConc', help = """
+		Oligo molar concentration. Default: 0.25e-6
+		""", default = [0.25e-6])
+	parser.add_argument('-l', '--hplen', type = int, nargs = 1,
+		metavar = 'hplen', help = """
+		Homopolymer stretch length in nt. Default: 4 nt
+		""", default = [4])
+	parser.add_argument('--gc', type = float, nargs = 2,
+		metavar = ('min', 'max'), help = """
+		GC content window, as fraction, boundaries included.
+		Default: 0 1""", default = [0., 1.])
+	parser.add_argument('--tm', type = float, nargs = 2,
+		metavar = ('min', 'max'), help = """
+		Melting temperature window, in Celsius, boundaries included.
+		Default: no window""", default = [-np.inf, np.inf])
+	parser.add_argument('-c', '--cache', type = int, nargs = 1,
+		metavar = 'size', help = """
+		Maximum number of distinct oligos kept in the cache.
+		Use 0 to disable the cache. Default: 1000000
+		""", default = [1000000])
+	parser.add_argument('-b', '--batch', type = int, nargs = 1,
+		metavar = 'batch', help = """
+		Number of oligos characterized at once. Default: 100000
+		""", default = [100000])
+	parser.add_argument('--skipped', type = str, nargs = 1,
+		metavar = 'bed', help = """
+		Path to BED-like report of the regions skipped for Ns, with columns:
+		ID, start, end, <k>mer, number of skipped k-mers.""",
+		default = [None])
+
+	# Add flags
+	parser.add_argument('--keep-hp',
+		action = 'store_const', dest = 'keep_hp',
+		const = True, default = False,
+		help = 'Keep oligos with homopolymer stretches.')
+	parser.add_argument('--no-progress',
+		action = 'store_const', dest = 'no_progress',
+		const = True, default = False,
+		help = 'Do not show the progress bar.')
+
+	# Parse arguments
+	args = parser.parse_args()
+
+	if 0 >= args.stride[0]:
+		parser.error("Invalid stride, it must be greater than 0.")
+
+	return(args)
+
+# FUNCTIONS ====================================================================
+
+def filtered_records(curr_id, seq, k, stride, oligo_conc, hp_len,
+	gc_win, tm_win, keep_hp, batch_size, cache = None, report = None):
+	'''
+	Build the fasta records of the k-mers of a sequence that pass the filters.
+
+	Args:
+		curr_id (string): sequence ID.
+		seq (string): sequence.
+		k (int): oligo length in nt.
+		stride (int): step between consecutive k-mers, in nt.
+		oligo_conc (float): oligo molar concentration.
+		hp_len (int): homopolymer stretch length in nt.
+		gc_win (tuple): (min, max) GC content.
+		tm_win (tuple): (min, max) melting temperature.
+		keep_hp (bool): keep oligos with homopolymer stretches.
+		batch_size (int): number of oligos characterized at once.
+		cache (OligoCache): optional cache, with the same settings.
+		report (file): optional skipped-region report.
+
+	Yields:
+		tuple: (records, number of k-mers, number of skipped k-mers) per batch.
+	'''
+
+	seq = seq.upper()
+
+	# Encoded k-mers, skipping those with Ns
+	codes = encode(seq)
+	(starts, ends, counts) = skipped_regions(codes, k, stride)
+	positions = clean_kmer_positions(starts, ends, len(codes), k, stride)
+	nskip = counts.sum()
+	if not report is None:
+		report.write(format_skipped(curr_id, k, starts, ends, counts))
+	if 0 == len(positions):
+		yield(("", nskip, nskip))
+		return
+
+	kmers = sliding_window_view(codes, k)
+	for a in range(0, len(positions), batch_size):
+		idx = positions[a:(a + batch_size)]
+		M = kmers[idx]
+
+		# Characterize and filter
+		if cache is None:
+			(fgc, tm, hp) = characterize_matrix(M, oligo_conc, hp_len)
+		else:
+			(fgc, tm, hp) = cache.characterize(M)
+		keep = (fgc >= gc_win[0]) & (fgc <= gc_win[1])
+		keep &= (tm >= tm_win[0]) & (tm <= tm_win[1])
+		if not keep_hp:
+			keep &= 0 == hp
+
+		records = "".join(["> %s_O%d:%f:%f:%d\n%s\n" % (curr_id, i, g, t, h,
+			seq[i:(i + k)]) for (i, g, t, h) in zip(idx[keep].tolist(),
+			fgc[keep].tolist(), tm[keep].tolist(), hp[keep].tolist())])
+
+		yield((records, len(idx) + nskip, nskip))
+		nskip = 0
+
+# RUN ==========================================================================
+
+if __name__ == '__main__':
+
+	# Parse arguments
+	args = parse_arguments()
+
+	# Assign to in-script variables
+	fa_in = args.fastaInput[0]
+	fa_out = args.fastaOutput[0]
+	k = args.k[0]
+	stride = args.stride[0]
+	oligo_conc = args.oligoconc[0]
+	hp_len = args.hplen[0]
+	gc_win = tuple(args.gc)
+	tm_win = tuple(args.tm)
+	keep_hp = args.keep_hp
+	batch_size = args.batch[0]
+	no_progress = args.no_progress
+	skipped = args.skipped[0]
+	fskip = None if skipped is None else open(skipped, 'w')
+	if 0 < args.cache[0]:
+		cache = OligoCache(args.cache[0], oligo_conc, hp_len)
+	else:
+		cache = None
+
+	# Log to screen the settings
+	print("""
+Settings:
+               FASTA input : %s
+              FASTA output : %s
+                         K : %d
+                    Stride : %d
+               Oligo conc. : %g M
+                GC content : %f - %f
+                        Tm : %f - %f
+   Homopolymer length (nt) : %d
+              Homopolymers : %s
+
+""" % (fa_in, fa_out, k, stride, oligo_conc, gc_win[0], gc_win[1],
+		tm_win[0], tm_win[1], hp_len, "keep" if keep_hp else "remove"))
+
+	# Go through the input sequence by sequence
+	n_kmer = 0
+	n_skip = 0
+	n_out = 0
+	with xopen(fa_in, 'r') as fi, xopen(fa_out, 'w',
+		buffering = 4 * 1024 * 1024) as fo:
+		bar = FileProgress(fi, no_progress, every = 1)
+		for (curr_id, seq) in fasta_records(fi):
+			for (records, n, nskip) in filtered_records(curr_id, seq, k,
+				stride, oligo_conc, hp_len, gc_win, tm_win, keep_hp,
+				batch_size, cache, fskip):
+				fo.write(records)
+				n_kmer += n
+				n_skip += nskip
+				n_out += records.count('\n') // 2
+			bar.update()
+		bar.finish()
+	if not fskip is None:
+		fskip.close()
+
+	print("Skipped %d (out of %d) k-mers containing Ns." % (n_skip, n_kmer))
+	print("Written %d k-mers passing the filters." % (n_out,))
+	if not cache is None:
+		print("Cache: %d distinct oligos characterized, %d reused." % (
+			cache.misses, cache.hits))
+
+	# END ======================================================================
+
+################################################################################
@@ -5,13 +5,28 @@
 # 
 # Author: Gabriele Girelli
 # Email: gigi.ga90@gmail.com
-# Version: 0.1.0
+# Version: 0.8.0
 # Date: 20170706
 # Project: COSMIC cancer gene census oligo characterization
 # Description:	generate oligos of length k from the provided fasta file.
 # 
 # Note:
 # 	The fasta file should have each sequence in one line.
+# 	The k-mer records of every sequence are built in bulk on a byte view of
+# 	the sequence, and written in large buffered blocks.
+# 	With multiple k values, the input is read once and one output per k is
+# 	generated (e.g., out.fa becomes out.25mer.fa, out.30mer.fa, ...).
+# 	The _O<i> suffix of the k-mer IDs is always the 0-indexed position of
+# 	the k-mer in the sequence, also when a stride is used.
+# 	Progress is tracked on the input byte offset, in a single pass.
+# 	With --table, k-mers are stored as a packed_seq.OligoTable (.npz) with
+# 	2-bit packed sequences instead of fasta, and k-mers with Ns are skipped.
+# 	With --skip-n, k-mers overlapping Ns (or any other non-ACGT character)
+# 	are not generated in the fasta output either. Their positions are found
+# 	from the N runs of each sequence, and the _O<i> suffixes are unchanged.
+# 	With --skipped, the skipped regions are reported in a BED-like file.
+# 	Input and output can be compressed (.gz, .bgz, .zst), by extension, and
+# 	compression extensions are kept last (e.g., out.30mer.fa.gz).
 # 
 # ------------------------------------------------------------------------------
 
@@ -20,86 +35,231 @@
 # DEPENDENCIES =================================================================
 
 import argparse
-import progressbar
+import numpy as np
+import os
+from numpy.lib.stride_tricks import sliding_window_view
+
+from compressed_io import split_compression_ext, xopen
+from packed_seq import OligoTable, clean_kmer_positions, encode, \
+	format_skipped, skipped_regions
+from progress import FileProgress
 
 # PARAMETERS ===================================================================
 
-# Add script description
-parser = argparse.ArgumentParser(
-	description = 'Generate k-mers from fasta file.'
-)
-
-# Add mandatory arguments
-parser.add_argument('k', type = int, nargs = 1,
-	help = "Oligo length in nt.")
-parser.add_argument('fastaInput', type = str, nargs = 1,
-	help = 'Path to input fasta file.')
-parser.add_argument('fastaOutput', type = str, nargs = 1,
-	help = 'Path to output with outfmt 6.')
-
-# Parse arguments
-args = parser.parse_args()
-
-# Assign to in-script variables
-fa_in = args.fastaInput[0]
-fa_out = args.fastaOutput[0]
-k = args.k[0]
-
-# Log to screen the settings
-print("""
-Settings:
-               FASTA input : %s
-              FASTA output : %s
-                         K : %d
+def parse_arguments():
+	'''Parse command line arguments.'''
 
-""" % (fa_in, fa_out, k))
+	# Add script description
+	parser = argparse.ArgumentParser(
+		description = 'Generate k-mers from fasta file.'
+	)
 
-# FUNCTIONS ====================================================================
+	# Add mandatory arguments
+	parser.add_argument('k', type = int, nargs = '+',
+		help = "Oligo length in nt. Multiple values are accepted.")
+	parser.add_argument('fastaInput', type = str, nargs = 1,
+		help = 'Path to input fasta file.')
+	parser.add_argument('fastaOutput', type = str, nargs = 1,
+		help = 'Path to output with outfmt 6.')
 
-def file_nrow(fname):
-    with open(fname) as f:
-        for i, l in enumerate(f):
-            pass
-    return(i + 1)
+	# Add arguments with default value
+	parser.add_argument('-s', '--stride', type = int, nargs = 1,
+		metavar = 'stride', help = """
+		Step between consecutive k-mers, in nt. Use k for non-overlapping tiles.
+		Default: 1""", default = [1])
 
-# RUN ==========================================================================
+	parser.add_argument('--skipped', type = str, nargs = 1,
+		metavar = 'bed', help = """
+		Path to BED-like report of the regions skipped for Ns, with columns:
+		ID, start, end, <k>mer, number of skipped k-mers. Requires --skip-n or
+		--table.""", default = [None])
+
+	# Add flags
+	parser.add_argument('--skip-n',
+		action = 'store_const', dest = 'skip_n',
+		const = True, default = False,
+		help = 'Do not generate k-mers overlapping Ns.')
+	parser.add_argument('--table',
+		action = 'store_const', dest = 'table',
+		const = True, default = False,
+		help = """Write a packed oligo table (.npz) instead of fasta. Only for
+		k up to 32 nt.""")
+	parser.add_argument('--no-progress',
+		action = 'store_const', dest = 'no_progress',
+		const = True, default = False,
+		help = 'Do not show the progress bar.')
+
+	# Parse arguments
+	args = parser.parse_args()
+
+	if 0 >= args.stride[0]:
+		parser.error("Invalid stride, it must be greater than 0.")
+	if args.table and max(args.k) > 32:
+		parser.error("Packed oligo tables support only k up to 32 nt.")
+	if not args.skipped[0] is None and not (args.skip_n or args.table):
+		parser.error("--skipped requires --skip-n or --table.")
 
-# Point to output file
-fo = open(fa_out, 'w')
+	return(args)
+
+# FUNCTIONS ====================================================================
+
+def fasta_records(fi):
+	'''
+	Args:
+		fi (file): open fasta file, with each sequence in one line.
+
+	Yields:
+		tuple: (ID, sequence), ID without the leading '>'.
+	'''
 
-# Go through the input line by line
-bar = progressbar.ProgressBar(max_value = file_nrow(fa_in) / 2)
-with open(fa_in, 'r') as fi:
 	# Save current ID
 	curr_id = None
-	i = 0
 
 	for line in fi:
 		# Check if it's an ID line or a sequence line
 		if line.strip().startswith('>'):
 			# Save ID
 			curr_id = line[1:].strip()
-			continue
 		else:
 			# Retreive sequence
-			seq = line.strip()
-			seq_len = len(seq)
+			yield((curr_id, line.strip()))
+
+def kmer_records(curr_id, seq, k, stride = 1, chunk = 65536, pos = None):
+	'''
+	Build the fasta records of every k-mer of a sequence, in bulk.
+
+	Args:
+		curr_id (string): sequence ID.
+		seq (string): sequence.
+		k (int): oligo length in nt.
+		stride (int): step between consecutive k-mers, in nt.
+		chunk (int): maximum number of records per block.
+		pos (np.ndarray): sorted positions of the k-mers to build, instead of
+			every k-mer on the stride.
+
+	Yields:
+		bytes: blocks of "> ID_O<i>\nKMER\n" records, in order.
+	'''
+
+	n = len(seq) - k + 1
+	if 0 >= n:
+		return
+
+	# Byte views of record header prefix and of every k-mer
+	prefix = np.frombuffer(("> %s_O" % (curr_id,)).encode(), dtype = np.uint8)
+	kmers = sliding_window_view(np.frombuffer(seq.encode(), dtype = np.uint8), k)
+	p = len(prefix)
+	if pos is None:
+		pos = np.arange(0, n, stride)
+
+	# Records with the same number of digits in the oligo index
+	# have the same length
+	start = 0
+	for d in range(1, len(str(n - 1)) + 1):
+		stop = min(n, 10 ** d)
+
+		# Positions in [start, stop)
+		positions = pos[np.searchsorted(pos, start):np.searchsorted(pos, stop)]
+
+		for a in range(0, len(positions), chunk):
+			idx = positions[a:(a + chunk)]
+
+			rec = np.empty((len(idx), p + d + k + 2), dtype = np.uint8)
+			rec[:, :p] = prefix
+			for j in range(d):
+				rec[:, p + j] = idx // 10 ** (d - 1 - j) % 10 + ord('0')
+			rec[:, p + d] = ord('\n')
+			rec[:, (p + d + 1):-1] = kmers[idx]
+			rec[:, -1] = ord('\n')
+
+			yield(rec.tobytes())
+		start = stop
+
+# RUN ==========================================================================
+
+if __name__ == '__main__':
+
+	# Parse arguments
+	args = parse_arguments()
+
+	# Assign to in-script variables
+	fa_in = args.fastaInput[0]
+	fa_out = args.fastaOutput[0]
+	ks = sorted(set(args.k))
+	stride = args.stride[0]
+	no_progress = args.no_progress
+	table = args.table
+	skip_n = args.skip_n or table
+	skipped = args.skipped[0]
+
+	# Output path per k
+	if 1 == len(ks):
+		fa_outs = {ks[0] : fa_out}
+	else:
+		(base, cext) = split_compression_ext(fa_out)
+		(root, ext) = os.path.splitext(base)
+		fa_outs = dict((k, "%s.%dmer%s%s" % (root, k, ext, cext)) for k in ks)
+
+	# Log to screen the settings
+	print("""
+Settings:
+               FASTA input : %s
+              FASTA output : %s
+                         K : %s
+                    Stride : %d
+
+""" % (fa_in, ", ".join(fa_outs[k] for k in ks),
+		", ".join("%d" % k for k in ks), stride))
+
+	# Point to output files, or tables
+	if table:
+		tables = dict((k, OligoTable(k)) for k in ks)
+	else:
+		fos = dict((k, xopen(fa_outs[k], 'wb', buffering = 4 * 1024 * 1024))
+			for k in ks)
+	if not skipped is None:
+		fskip = open(skipped, 'w')
+
+	# Go through the input sequence by sequence
+	n_skip = 0
+	with xopen(fa_in, 'r') as fi:
+		bar = FileProgress(fi, no_progress, every = 1)
+		for (curr_id, seq) in fasta_records(fi):
 
-			# Generate oligos
-			oligos = [seq[i:(i + k)] for i in range(seq_len - k + 1)]
+			# Generate and write oligos
+			if skip_n:
+				codes = encode(seq.upper())
+				for k in ks:
+					(starts, ends, counts) = skipped_regions(codes, k, stride)
+					pos = clean_kmer_positions(starts, ends, len(codes), k, stride)
+					n_skip += counts.sum()
+					if not skipped is None:
+						fskip.write(format_skipped(curr_id, k, starts, ends, counts))
+					if table:
+						tables[k].add(curr_id, pos, sliding_window_view(codes, k)[pos])
+					else:
+						fos[k].writelines(kmer_records(curr_id, seq, k, stride,
+							pos = pos))
+			else:
+				for k in ks:
+					fos[k].writelines(kmer_records(curr_id, seq, k, stride))
 
-			# Write oligos
-			for oi in range(len(oligos)):
-				sout = "> %s_O%d\n%s\n" % (curr_id, oi, oligos[oi])
-				fo.write(sout)
-		
-		bar.update(i)
-		i += 1
+			bar.update()
+		bar.finish()
 
-# Close file pointers
-fi.close()
-fo.close()
+	# Write tables, or close file pointers
+	if table:
+		for k in ks:
+			tables[k].save(fa_outs[k])
+			print(" >>> Stored %d %d-mers in %s." % (len(tables[k]), k, fa_outs[k]))
+	else:
+		for fo in fos.values():
+			fo.close()
+	if not skipped is None:
+		fskip.close()
+	if skip_n:
+		print(" >>> Skipped %d k-mers containing Ns." % (n_skip,))
 
-# END ==========================================================================
+	# END ======================================================================
 
 ################################################################################
@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# ------------------------------------------------------------------------------
+# 
+# Author: Gabriele Girelli
+# Email: gigi.ga90@gmail.com
+# Version: 1.2.0
+# Date: 20170724
+# Project: 680 genes
+# Description:	compact 2-bit sequence representation, shared by the oligo
+# 				tools.
+# 
+# Notes:
+# 		Nucleotides are coded as A:0, C:1, G:2, T:3, so that the complement
+# 		of a code x is 3 - x (or ~x on 2 bits). Any other character is coded
+# 		as MASK, and masked sequences cannot be packed.
+# 		Sequences of up to 32 nt are packed into one uint64, first
+# 		nucleotide in the most significant bits. A packed sequence does not
+# 		carry its length, that is stored separately when needed.
+# 		String reverse complements are table-driven (str.translate), for
+# 		single sequences, or NumPy byte lookups, for batches.
+# 		Masked stretches closer than k nt are merged into skipped regions, so
+# 		that the clean k-mers are found from the gaps between regions, without
+# 		generating and discarding the k-mers overlapping them.
+# 
+# Changelog:
+# 		1.0.0: first implementation.
+# 		1.1.0: table-driven reverse complement of DNA/RNA strings.
+# 		1.2.0: skipped regions and clean k-mer positions around masked runs.
+# 
+# ------------------------------------------------------------------------------
+
+
+
+# DEPENDENCIES =================================================================
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# PARAMETERS ===================================================================
+
+# Nucleotide codes
+NT = 'ACGT'
+MASK = 255
+NT_CODE = np.full(256, MASK, dtype = np.uint8)
+for (i, nt) in enumerate(NT):
+	NT_CODE[ord(nt)] = i
+NT_BYTE = np.frombuffer(NT.encode(), dtype = np.uint8)
+
+# Longest sequence that fits a uint64
+MAX_PACKED_LEN = 32
+
+# Complement alphabets, upper and lower case
+COMPLEMENT = {
+	'dna' : ('ACGTacgt', 'TGCAtgca'),
+	'rna' : ('ACGUacgu', 'UGCAugca')
+}
+COMPLEMENT_STR = dict((t, str.maketrans(*ab)) for (t, ab) in COMPLEMENT.items())
+COMPLEMENT_BYTE = {}
+for (t, (ab, cab)) in COMPLEMENT.items():
+	COMPLEMENT_BYTE[t] = np.zeros(256, dtype = np.uint8)
+	COMPLEMENT_BYTE[t][np.frombuffer(ab.encode(), dtype = np.uint8)] = (
+		np.frombuffer(cab.encode(), dtype = np.uint8))
+
+# FUNCTIONS ====================================================================
+
+def encode(seq):
+	'''
+	Args:
+		seq (string): upper-case sequence.
+
+	Return:
+		np.ndarray: uint8 nucleotide codes, MASK for non-ACGT characters.
+	'''
+	return(NT_CODE[np.frombuffer(seq.encode(), dtype = np.uint8)])
+
+def decode(M):
+	'''
+	Args:
+		M (np.ndarray): unmasked sequences of the same length, one per row, as
+			nucleotide codes.
+
+	Return:
+		list: sequences, as strings.
+	'''
+
+	M = np.atleast_2d(M)
+	b = NT_BYTE[M].tobytes().decode()
+	L = M.shape[1]
+	return([b[i:(i + L)] for i in range(0, len(b), L)])
+
+def skipped_regions(codes, k, stride = 1):
+	'''
+	Args:
+		codes (np.ndarray): nucleotide codes of a sequence, from encode.
+		k (int): oligo length in nt.
+		stride (int): step between consecutive k-mers, in nt.
+
+	Return:
+		tuple: (starts, ends, counts). 0-indexed, half-open, masked
+		stretches, merged when less than k nt apart, and number of k-mers
+		on the stride overlapping each of them.
+	'''
+
+	# Edges of the masked runs
+	edges = np.diff(np.concatenate([[0], codes == MASK, [0]]).astype(np.int8))
+	starts = np.flatnonzero(1 == edges)
+	ends = np.flatnonzero(-1 == edges)
+
+	# No clean k-mer fits a gap shorter than k
+	if 1 < len(starts):
+		fits = (starts[1:] - ends[:-1]) >= k
+		starts = starts[np.concatenate([[True], fits])]
+		ends = ends[np.concatenate([fits, [True]])]
+
+	# Overlapping k-mers start in [start - k + 1, end), on the stride
+	n = max(0, len(codes) - k + 1)
+	lo = np.maximum(0, starts - k + 1)
+	hi = np.minimum(ends, n)
+	counts = np.maximum(0, -(-hi // stride) + (-lo // stride))
+
+	return((starts, ends, counts))
+
+def clean_kmer_positions(starts, ends, length, k, stride = 1):
+	'''
+	Args:
+		starts (np.ndarray): skipped region starts, from skipped_regions.
+		ends (np.ndarray): skipped region ends, from skipped_regions.
+		length (int): sequence length in nt.
+		k (int): oligo length in nt.
+		stride (int): step between consecutive k-mers, in nt.
+
+	Return:
+		np.ndarray: positions of the k-mers on the stride that do not overlap
+		any skipped region, in order.
+	'''
+
+	n = length - k + 1
+	if 0 >= n:
+		return(np.zeros(0, dtype = np.int64))
+
+	# Clean k-mers start in [end of a region, start of the next - k + 1)
+	lo = np.concatenate([[0], ends]).astype(np.int64)
+	hi = np.minimum(np.concatenate([starts - k + 1, [n]]), n)
+	lo += (-lo) % stride
+	counts = np.maximum(0, (hi - lo + stride - 1) // stride)
+
+	# Concatenated ranges, without a loop over the gaps
+	first = np.concatenate([[0], np.cumsum(counts)[:-1]])
+	return(np.repeat(lo - stride * first, counts) +
+		stride * np.arange(counts.sum(), dtype = np.int64))
+
+def kmer_codes(codes, k, stride = 1):
+	'''
+	Args:
+		codes (np.ndarray): nucleotide codes of a sequence, from encode.
+		k (int): oligo length in nt.
+		stride (int): step between consecutive k-mers, in nt.
+
+	Return:
+		tuple: (pos, M, valid). pos are the k-mer positions, M is a
+		read-only view with one k-mer per row, and valid flags the k-mers
+		without masked nucleotides.
+	'''
+
+	n = len(codes) - k + 1
+	if 0 >= n:
+		return((np.zeros(0, dtype = np.int64),
+			np.zeros((0, k), dtype = np.uint8), np.zeros(0, dtype = bool)))
+
+	# Count masked nucleotides per window
+	masked = np.concatenate([[0], np.cumsum(codes == MASK)])
+	pos = np.arange(0, n, stride)
+	valid = masked[pos + k] == masked[pos]
+
+	return((pos, sliding_window_view(codes, k)[pos], valid))
+
+def format_skipped(curr_id, k, starts, ends, counts):
+	'''
+	Args:
+		curr_id (string): sequence ID.
+		k (int): oligo length in nt.
+		starts, ends, counts (np.ndarray): from skipped_regions.
+
+	Return:
+		string: BED-like rows, "ID start end <k>mer skipped_kmers".
+	'''
+	return("".join(["%s\t%d\t%d\t%dmer\t%d\n" % (curr_id, a, b, k, c)
+		for (a, b, c) in zip(starts.tolist(), ends.tolist(), counts.tolist())]))
+
+def pack_2bit(M):
+	'''
+	Args:
+		M (np.ndarray): unmasked sequences of up to 32 nt, one per row, as
+			nucleotide codes.
+
+	Return:
+		np.ndarray: one uint64 per row, 2 bits per nucleotide.
+	'''
+
+	keys = np.zeros(M.shape[0], dtype = np.uint64)
+	for j in range(M.shape[1]):
+		keys = (keys << np.uint64(2)) | M[:, j].astype(np.uint64)
+	return(keys)
+
+def unpack_2bit(keys, L):
+	'''
+	Args:
+		keys (np.ndarray): packed sequences of the same length.
+		L (int): sequence length in nt.
+
+	Return:
+		np.ndarray: nucleotide codes, one sequence per row.
+	'''
+
+	shifts = np.arange(2 * (L - 1), -1, -2, dtype = np.uint64)
+	return(((np.asarray(keys, dtype = np.uint64)[:, None] >> shifts) &
+		np.uint64(3)).astype(np.uint8))
+
+def revcomp_codes(M):
+	'''
+	Args:
+		M (np.ndarray): sequences of the same length, one per row, as
+			nucleotide codes.
+
+	Return:
+		np.ndarray: reverse complement codes. Masked nucleotides stay masked.
+	'''
+
+	R = M[..., ::-1]
+	return(np.where(MASK == R, MASK, 3 - R).astype(np.uint8))
+
+def revcomp_2bit(keys, L):
+	'''
+	Args:
+		keys (np.ndarray): packed sequences of the same length.
+		L (int): sequence length in nt, from 1 to 32.
+
+	Return:
+		np.ndarray: packed reverse complements.
+	'''
+
+	# Complement, then reverse the order of the 2-bit groups
+	x = ~np.asarray(keys, dtype = np.uint64)
+	x = ((x >> np.uint64(2)) & np.uint64(0x3333333333333333)) | (
+		(x & np.uint64(0x3333333333333333)) << np.uint64(2))
+	x = ((x >> np.uint64(4)) & np.uint64(0x0F0F0F0F0F0F0F0F)) | (
+		(x & np.uint64(0x0F0F0F0F0F0F0F0F)) << np.uint64(4))
+	x = x.byteswap()
+	return(x >> np.uint64(64 - 2 * L))
+
+def complement_table(t):
+	'''Check the nucleic acid type, and return its type name.'''
+	t = t.lower()
+	if not t in COMPLEMENT:
+		raise ValueError("Unknown nucleic acid type '%s'." % (t,))
+	return(t)
+
+def invalid_chars(seq, t = 'dna'):
+	'''
+	Args:
+		seq (string): nucleic acid sequence.
+		t (string): nucleic acid type, either 'dna' or 'rna'.
+
+	Return:
+		set: characters of seq outside of the alphabet of t.
+	'''
+	t = complement_table(t)
+	return(set(seq.translate(str.maketrans('', '', COMPLEMENT[t][0]))))
+
+def revcomp(seq, t = 'dna', validate = True):
+	'''
+	Args:
+		seq (string): nucleic acid sequence, any case.
+		t (string): nucleic acid type, either 'dna' or 'rna'.
+		validate (bool): raise ValueError on characters outside of the
+			alphabet. Otherwise, they are kept as they are.
+
+	Return:
+		string: reverse complement of seq, same case.
+	'''
+
+	t = complement_table(t)
+	if validate:
+		bad = invalid_chars(seq, t)
+		if 0 != len(bad):
+			raise ValueError("Invalid %s characters: %s." % (t.upper(),
+				", ".join(sorted(bad))))
+	return(seq.translate(COMPLEMENT_STR[t])[::-1])
+
+def revcomp_batch(seqs, t = 'dna', validate = True):
+	'''
+	Reverse complement many sequences at once. The reverse complement of
+	a concatenation is the concatenation of the reverse complements, in
+	reverse order, so any mix of lengths is processed in one lookup.
+
+	Args:
+		seqs (list): nucleic acid sequences, any case.
+		t (string): nucleic acid type, either 'dna' or 'rna'.
+		validate (bool): raise a single ValueError listing every character
+			outside of the alphabet in the batch. Otherwise, they are kept
+			as they are.
+
+	Return:
+		list: reverse complements, in the order of seqs.
+	'''
+
+	t = complement_table(t)
+	if 0 == len(seqs):
+		return([])
+
+	b = np.frombuffer(''.join(seqs).encode(), dtype = np.uint8)
+	c = COMPLEMENT_BYTE[t][b]
+	bad = 0 == c
+	if bad.any():
+		if validate:
+			raise ValueError("Invalid %s characters in batch: %s." % (
+				t.upper(), ", ".join(sorted(set(b[bad].tobytes().decode())))))
+		c[bad] = b[bad]
+	rcb = c[::-1].tobytes().decode()
+
+	# Split, from the last sequence to the first
+	out = []
+	start = 0
+	for seq in reversed(seqs):
+		out.append(rcb[start:(start + len(seq))])
+		start += len(seq)
+	return(out[::-1])
+
+def is_palindrome(seq, t = 'dna'):
+	'''
+	Check whether a sequence is its own reverse complement, comparing its
+	first half to the reverse complement of its second half only.
+
+	Args:
+		seq (string): nucleic acid sequence, any case.
+		t (string): nucleic acid type, either 'dna' or 'rna'.
+
+	Return:
+		bool: False also for sequences with characters outside the alphabet.
+	'''
+
+	t = complement_table(t)
+	L = len(seq)
+	if 0 != L % 2:
+		return(False)
+	h = L // 2
+	head = seq[:h]
+	return(head == seq[h:].translate(COMPLEMENT_STR[t])[::-1] and
+		0 == len(invalid_chars(head, t)))
+
+def is_palindrome_codes(M):
+	'''
+	Args:
+		M (np.ndarray): sequences of the same length, one per row, as
+			nucleotide codes.
+
+	Return:
+		np.ndarray: one bool per row, True for unmasked sequences that are
+		their own reverse complement.
+	'''
+
+	L = M.shape[1]
+	if 0 != L % 2:
+		return(np.zeros(M.shape[0], dtype = bool))
+	h = L // 2
+	head = M[:, :h]
+	tail = M[:, ::-1][:, :h]
+	return(((head == 3 - tail) & (MASK != head)).all(1))
+
+class OligoTable(object):
+	'''
+	Array-backed table of oligos of the same length: packed sequence, source
+	sequence and position in it. The oligo ID is the mk_oligos header,
+	SOURCE_O<position>.
+	'''
+
+	def __init__(self, k):
+		'''
+		Args:
+			k (int): oligo length in nt, up to 32.
+		'''
+
+		if k > MAX_PACKED_LEN:
+			raise ValueError("Oligos longer than %d nt cannot be packed." % (
+				MAX_PACKED_LEN,))
+		self.k = k
+		self.names = []
+		self.parts = []
+		self.source = np.zeros(0, dtype = np.int32)
+		self.position = np.zeros(0, dtype = np.int32)
+		self.key = np.zeros(0, dtype = np.uint64)
+
+	def add(self, name, pos, M):
+		'''
+		Args:
+			name (string): source sequence ID.
+			pos (np.ndarray): oligo positions in the source sequence.
+			M (np.ndarray): unmasked oligos, one per row, as nucleotide codes.
+		'''
+
+		self.parts.append((np.full(len(pos), len(self.names), dtype = np.int32),
+			np.asarray(pos, dtype = np.int32), pack_2bit(M)))
+		self.names.append(name)
+
+	def _flush(self):
+		'''Merge the added parts into the table arrays.'''
+		if 0 != len(self.parts):
+			(source, position, key) = zip(*self.parts)
+			self.source = np.concatenate((self.source,) + source)
+			self.position = np.concatenate((self.position,) + position)
+			self.key = np.concatenate((self.key,) + key)
+			self.parts = []
+
+	def __len__(self):
+		self._flush()
+		return(len(self.key))
+
+	def ids(self, idx = None):
+		'''
+		Args:
+			idx (np.ndarray): row indexes, all rows by default.
+
+		Return:
+			list: oligo IDs.
+		'''
+
+		self._flush()
+		if idx is None:
+			idx = np.arange(len(self.key))
+		return(["%s_O%d" % (self.names[s], p) for (s, p) in zip(
+			self.source[idx].tolist(), self.position[idx].tolist())])
+
+	def sequences(self, idx = None):
+		'''
+		Args:
+			idx (np.ndarray): row indexes, all rows by default.
+
+		Return:
+			list: oligo sequences.
+		'''
+
+		self._flush()
+		if idx is None:
+			idx = np.arange(len(self.key))
+		return(decode(unpack_2bit(self.key[idx], self.k)))
+
+	def save(self, path):
+		'''
+		Args:
+			path (string): path to output .npz file.
+		'''
+
+		self._flush()
+		np.savez(path, k = self.k, names = np.array(self.names, dtype = 'S'),
+			source = self.source, position = self.position, key = self.key)
+
+	@classmethod
+	def load(cls, path):
+		'''
+		Args:
+			path (string): path to .npz file, from save.
+
+		Return:
+			OligoTable: loaded table.
+		'''
+
+		data = np.load(path)
+		table = cls(int(data['k']))
+		table.names = data['names'].astype(str).tolist()
+		table.source = data['source']
+		table.position = data['position']
+		table.key = data['key']
+		return(table)
+
+# END ==========================================================================
+
+################################################################################
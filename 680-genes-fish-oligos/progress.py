@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# ------------------------------------------------------------------------------
+# 
+# Author: Gabriele Girelli
+# Email: gigi.ga90@gmail.com
+# Version: 1.2.0
+# Date: 20170724
+# Project: 680 genes
+# Description:	progress of a single pass over an input file, by byte offset.
+# 
+# Notes:
+# 		The progress bar is sized on the input file size, and moved forward
+# 		based on the offset of the underlying binary buffer. Thus, the input
+# 		is not scanned in advance to count its lines. Throughput is reported
+# 		as records/s and MB/s.
+# 		Compressed inputs (compressed_io.xopen) are tracked on the offset of
+# 		the compressed file, so that sizes and speeds refer to it.
+# 
+# Changelog:
+# 		1.0.0: first implementation.
+# 		1.1.0: byte offset can be provided on update, for parallel readers.
+# 		1.2.0: compressed input support.
+# 
+# ------------------------------------------------------------------------------
+
+
+
+# DEPENDENCIES =================================================================
+
+import os
+import sys
+import time
+
+import progressbar
+
+# FUNCTIONS ====================================================================
+
+class FileProgress(object):
+	'''Byte-offset progress bar over an open file.'''
+
+	def __init__(self, f, disable = False, every = 4096):
+		'''
+		Args:
+			f (file): open input file, in text or binary mode.
+			disable (bool): do not show the progress bar.
+			every (int): number of records between bar updates.
+		'''
+
+		# Binary buffer, its offset can be read also while iterating on lines
+		self.raw = getattr(f, 'buffer', f)
+
+		# Compressed file, read ahead by a background thread
+		self.fd = getattr(f, 'compressed_fileno', None)
+		if self.fd is None:
+			self.size = max(1, os.fstat(self.raw.fileno()).st_size)
+		else:
+			self.size = max(1, os.fstat(self.fd).st_size)
+		self.every = every
+		self.nrec = 0
+		self.start = time.time()
+
+		if disable:
+			self.bar = None
+		else:
+			self.rate = progressbar.FormatCustomText(
+				'%(rps)d rec/s', dict(rps = 0))
+			self.bar = progressbar.ProgressBar(max_value = self.size,
+				widgets = [progressbar.Percentage(), ' ', progressbar.Bar(),
+				' ', self.rate, ' ', progressbar.FileTransferSpeed(), ' ',
+				progressbar.ETA()])
+			self.bar.start()
+
+	def update(self, n = 1, pos = None):
+		'''
+		Args:
+			n (int): number of records just consumed.
+			pos (int): current byte offset, when the input is not read
+				through the file given at init.
+		'''
+
+		self.nrec += n
+		if self.bar is None or self.nrec % self.every >= n:
+			return
+
+		elapsed = max(time.time() - self.start, 1e-9)
+		self.rate.update_mapping(rps = self.nrec / elapsed)
+		if pos is None and self.fd is None:
+			pos = self.raw.tell()
+		elif pos is None:
+			pos = os.lseek(self.fd, 0, os.SEEK_CUR)
+		self.bar.update(min(pos, self.size))
+
+	def finish(self):
+		'''Close the progress bar and log the overall throughput.'''
+
+		elapsed = max(time.time() - self.start, 1e-9)
+		if not self.bar is None:
+			self.rate.update_mapping(rps = self.nrec / elapsed)
+			self.bar.finish()
+			print(" >>> %d records in %.1f s (%d rec/s, %.1f MB/s)." % (
+				self.nrec, elapsed, self.nrec / elapsed,
+				self.size / elapsed / 1024 / 1024))
+			sys.stdout.flush()
+
+# END ==========================================================================
+
+################################################################################
@@ -1,15 +1,53 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
 # ------------------------------------------------------------------------------
 # 
 # Author: Gabriele Girelli
 # Email: gigi.ga90@gmail.com
-# Version: 1.0.0
+# Version: 1.6.2
 # Date: 20170722
 # Project: 680 genes
 # Description: split fasta based on header pattern
 # 
+# Notes:
+# 		Records are written through a pool of buffered writers: records are
+# 		batched per output file, and batches are written when the buffered
+# 		size exceeds a threshold (--buffer), through an LRU of open file
+# 		handles capped below the open file limit (--max-open). Thus, memory
+# 		use is bounded regardless of the number of genes and records.
+# 		With -t, the input is cut in byte ranges aligned on record headers,
+# 		each range is split by a worker process into shard files, and shards
+# 		are concatenated per key, in input order. The output is the same as
+# 		with a single process.
+# 		With --index, a single fasta grouped by key is written instead of one
+# 		file per key, with a TSV index (<fasta>.idx) of key, byte offset,
+# 		byte length and record count. Records are first spilled to a bounded
+# 		number of bucket files, by key hash, in a local temporary folder
+# 		($TMPDIR). Then, every bucket is grouped by key in memory, and
+# 		written to the output fasta while indexing it, so keys are grouped
+# 		in bucket order, not sorted. A fasta already grouped by key can be
+# 		indexed in place. FastaIndex reads the records of one key from a
+# 		memory map of the fasta, without copies.
+# 		With --append, split_fa_by_gene.sh is replicated: records are pairs of
+# 		lines, keys are the first space/underscore field of the header
+# 		(after a leading '> '), and records are appended to existing files.
+# 		The input can be compressed (.gz, .bgz, .zst), by extension, and
+# 		outputs are compressed with -z. Compressed members and frames are
+# 		appended, so pooled writers and shard merges work as for plain files.
+# 
+# Changelog:
+# 		1.1.0: progress on input byte offset, single pass over the input.
+# 		1.2.0: pooled buffered writers, bounded memory. Lines before the first
+# 			header are not written to an empty-named output anymore.
+# 		1.3.0: parallel split by byte ranges (-t).
+# 		1.4.0: grouped fasta index (--index), and memory-mapped reader.
+# 		1.5.0: split_fa_by_gene.sh drop-in mode (--append).
+# 		1.6.0: compressed input and output.
+# 		1.6.1: --index groups records through hash buckets, without per-key
+# 			files.
+# 		1.6.2: FastaIndex.records reads records with an empty sequence.
+# 
 # ------------------------------------------------------------------------------
 
 
@@ -17,115 +55,703 @@
 # DEPENDENCIES =================================================================
 
 import argparse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import mmap
+import multiprocessing
 import os
-import progressbar
+import resource
+import shutil
+import sys
+import tempfile
+import zlib
+from functools import partial
 
-# PARAMETERS ===================================================================
+from compressed_io import compression, xopen
+from progress import FileProgress
 
+# PARAMETERS ===================================================================
 
-# Add script description
-parser = argparse.ArgumentParser(
-	description = 'Split fasta file based on header pattern'
-)
+def parse_arguments():
+	'''Parse command line arguments.'''
 
-# Add mandatory arguments
-parser.add_argument('inFasta', type = str, nargs = 1,
-	help = 'Input fasta file.')
-parser.add_argument('outdir', type = str, nargs = 1,
-	help = 'Output folder.')
+	# Add script description
+	parser = argparse.ArgumentParser(
+		description = 'Split fasta file based on header pattern'
+	)
 
-# Add arguments with default value
-parser.add_argument('-d', type = str, nargs = 1,
-	metavar = 'delim', help = """
-	Delimiter. Default: '_'""", default = ["_"])
-parser.add_argument('-f', type = int, nargs = 1,
-	metavar = 'field', help = """
-	0-indexed field ID. Default: 0""", default = [0])
+	# Add mandatory arguments
+	parser.add_argument('inFasta', type = str, nargs = 1,
+		help = 'Input fasta file.')
+	parser.add_argument('outdir', type = str, nargs = 1,
+		help = 'Output folder, or output fasta file with --index.')
 
+	# Add arguments with default value
+	parser.add_argument('-d', type = str, nargs = 1,
+		metavar = 'delim', help = """
+		Delimiter. Default: '_'""", default = ["_"])
+	parser.add_argument('-f', type = int, nargs = 1,
+		metavar = 'field', help = """
+		0-indexed field ID. Default: 0""", default = [0])
+	parser.add_argument('--max-open', type = int, nargs = 1,
+		metavar = 'n', help = """
+		Maximum number of output files open at once. Default: below the open
+		file limit, up to 1024""", default = [None])
+	parser.add_argument('--buffer', type = int, nargs = 1,
+		metavar = 'MB', help = """
+		Maximum size of the records buffered before writing, in MB.
+		Default: 64""", default = [64])
+	parser.add_argument('-t', '--threads', type = int, nargs = 1,
+		metavar = 'threads', help = """
+		Number of worker processes, each splitting a byte range of the input.
+		Default: 1""", default = [1])
+	parser.add_argument('-z', '--compress', type = str, nargs = 1,
+		choices = ['gz', 'bgz', 'zst'], help = """
+		Compress the outputs, named <key>.fa.<compress>.""", default = [None])
 
-# Add flags
-parser.add_argument('-o',
-	action = 'store_const', dest = 'only_once',
-	const = True, default = False,
-	help = 'Write output once, instead of appending.')
+	# Add flags
+	parser.add_argument('-o',
+		action = 'store_const', dest = 'only_once',
+		const = True, default = False,
+		help = """Write output once, instead of appending. Kept for
+		compatibility, records are always written in batches.""")
+	parser.add_argument('--index',
+		action = 'store_const', dest = 'index',
+		const = True, default = False,
+		help = """Write a single fasta file, grouped by key, and its index
+		(<fasta>.idx), instead of one file per key. If the output is the input
+		itself, it must be grouped by key already, and it is only indexed.""")
+	parser.add_argument('--append',
+		action = 'store_const', dest = 'append',
+		const = True, default = False,
+		help = """Same as split_fa_by_gene.sh: one-line sequences, split on the
+		first space/underscore field of the header, append to existing files.
+		-d and -f are ignored.""")
+	parser.add_argument('--no-progress',
+		action = 'store_const', dest = 'no_progress',
+		const = True, default = False,
+		help = 'Do not show the progress bar.')
 
-# Parse arguments
-args = parser.parse_args()
+	# Parse arguments
+	args = parser.parse_args()
 
-# Assign to in-script variables
-fain_path = args.inFasta[0]
-outdir = args.outdir[0]
-delim = args.d[0]
-field = args.f[0]
-only_once = args.only_once
+	if not args.max_open[0] is None and 0 >= args.max_open[0]:
+		parser.error("Invalid --max-open, it must be greater than 0.")
+	if 0 >= args.buffer[0]:
+		parser.error("Invalid --buffer, it must be greater than 0.")
+	if args.append and (args.index or 1 < args.threads[0]):
+		parser.error("--append is not supported with --index or -t.")
+	if args.index and not args.compress[0] is None:
+		parser.error("-z is not supported with --index.")
+	if not compression(args.inFasta[0]) is None and 1 < args.threads[0]:
+		parser.error("-t is not supported with compressed input.")
 
-# Create outdir if it does not exist
-if not os.path.isdir(outdir):
-	os.mkdir(outdir)
+	return(args)
 
 # FUNCTIONS ====================================================================
 
-def file_nrow(fname):
-    with open(fname) as f:
-        for i, l in enumerate(f):
-            pass
-    return(i + 1)
+def default_max_open(reserved = 32, cap = 1024):
+	'''
+	Args:
+		reserved (int): file descriptors left for the rest of the process.
+		cap (int): maximum number of open output files.
 
-def split_fa(head, seq, d, only_once):
-	k = head.split(delim)[field][1:].strip()
-	if k in d.keys():
-		d[k] += "%s\n%s\n" % (head, seq,)
+	Return:
+		int: number of output files that can be open at once.
+	'''
+	soft = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+	if resource.RLIM_INFINITY == soft:
+		return(cap)
+	return(max(1, min(cap, soft - reserved)))
 
-		if not only_once:
-			fout = open("%s/%s.fa" % (outdir, k), 'a+')
-			fout.write("%s\n%s\n" % (head, seq,))
-			fout.close()
-	else:
-		d[k] = "%s\n%s\n" % (head, seq,)
+class WriterPool(object):
+	'''Buffered writers to many output files, with an LRU of open handles.'''
+
+	def __init__(self, outdir, max_open = None, max_buffer = 64 * 1024 * 1024,
+		mode = 'w', ext = '.fa'):
+		'''
+		Args:
+			outdir (string): output folder, files are named <key><ext>.
+			max_open (int): maximum number of open files, None for default.
+			max_buffer (int): maximum buffered size in bytes.
+			mode (string): 'w' to overwrite existing outputs, 'a' to append.
+			ext (string): output extension, compressed by compressed_io.
+		'''
+
+		self.outdir = outdir
+		self.ext = ext
+		self.max_open = default_max_open() if max_open is None else max_open
+		self.max_buffer = max_buffer
+		self.mode = mode
+
+		# Open handles, least recently used first
+		self.handles = OrderedDict()
+
+		# Keys whose output was already opened once in this run
+		self.started = set()
+
+		# Buffered records per key
+		self.buffers = {}
+		self.size = 0
+
+	def path(self, key):
+		'''Path to the output file of a key.'''
+		return("%s/%s%s" % (self.outdir, key, self.ext))
 
-		if not only_once:
-			fout = open("%s/%s.fa" % (outdir, k), 'w+')
-			fout.write("%s\n%s\n" % (head, seq,))
+	def handle(self, key):
+		'''
+		Args:
+			key (string): output key.
+
+		Return:
+			file: open handle to the output of key, evicting the least
+			recently used one if needed.
+		'''
+
+		if key in self.handles:
+			self.handles.move_to_end(key)
+			return(self.handles[key])
+
+		while len(self.handles) >= self.max_open:
+			self.handles.popitem(last = False)[1].close()
+
+		mode = 'a' if key in self.started else self.mode
+		self.started.add(key)
+		self.handles[key] = xopen(self.path(key), mode)
+		return(self.handles[key])
+
+	def write(self, key, text):
+		'''
+		Args:
+			key (string): output key.
+			text (string): records to append to the output of key.
+		'''
+
+		if key in self.buffers:
+			self.buffers[key].append(text)
+		else:
+			self.buffers[key] = [text]
+		self.size += len(text)
+
+		if self.size >= self.max_buffer:
+			self.flush()
+
+	def flush(self):
+		'''Write every buffered batch, one write per key.'''
+		for (key, texts) in self.buffers.items():
+			self.handle(key).write("".join(texts))
+		self.buffers = {}
+		self.size = 0
+
+	def close(self):
+		'''Write what is left, and close every handle.'''
+		self.flush()
+		for fout in self.handles.values():
 			fout.close()
+		self.handles = OrderedDict()
 
-	return(d)
+def header_key(head, delim, field):
+	'''
+	Args:
+		head (string): fasta header, with the leading '>'.
+		delim (string): field delimiter.
+		field (int): 0-indexed field ID.
 
-# RUN ==========================================================================
+	Return:
+		string: output key, the field without its first character.
+	'''
+	return(head.split(delim)[field][1:].strip())
 
-d = {}
-curr_head = ""
-curr_seq = ""
+def fasta_entries(fain, bar = None):
+	'''
+	Args:
+		fain (file): open fasta file, sequences can span multiple lines.
+		bar (FileProgress): optional progress bar, updated per record.
+
+	Yields:
+		tuple: (header, sequence), with the header leading '>'.
+	'''
+
+	curr_head = None
+	curr_seq = []
 
-bar = progressbar.ProgressBar(max_value = file_nrow(fain_path))
-with open(fain_path, 'r') as fain:
-	i = 0
 	for row in fain:
-		bar.update(i)
-		i += 1
+		if '>' == row[:1]:
+			if not bar is None:
+				bar.update()
+			if not curr_head is None:
+				yield((curr_head, "".join(curr_seq)))
+			curr_head = row.strip()
+			curr_seq = []
+		else:
+			curr_seq.append(row.strip())
 
-		if '>' == row[0]:
-			# Run split
-			d = split_fa(curr_head, curr_seq, d, only_once)
+	if not curr_head is None:
+		yield((curr_head, "".join(curr_seq)))
 
-			# Reset seq
-			curr_seq = ""
+def gene_key(head):
+	'''
+	Args:
+		head (string): fasta header.
 
-			# Read head
-			curr_head = row.strip()
+	Return:
+		string: output key as in split_fa_by_gene.sh, the first space or
+		underscore delimited field, after removing a leading '> '.
+	'''
+	if head.startswith('> '):
+		head = head[2:]
+	return(head.replace('_', ' ').split(' ')[0])
+
+def split_fa_by_gene(fain, pool, bar = None):
+	'''
+	Split a fasta file as split_fa_by_gene.sh, with pairs of lines as records.
+
+	Args:
+		fain (file): open fasta file, with each sequence in one line.
+		pool (WriterPool): output writers, in append mode.
+		bar (FileProgress): optional progress bar.
+
+	Return:
+		int: number of records.
+	'''
+
+	n = 0
+	lines = iter(fain)
+	for head in lines:
+		seq = next(lines, '')
+		if not bar is None:
+			bar.update()
+		if head.startswith('>'):
+			head = head.rstrip('\n')
+			pool.write(gene_key(head), "%s\n%s\n" % (head, seq.rstrip('\n')))
+			n += 1
+	return(n)
+
+def bucket_key(key, nbuckets):
+	'''
+	Args:
+		key (string): output key.
+		nbuckets (int): number of buckets.
+
+	Return:
+		string: bucket of key, stable across processes.
+	'''
+	return("%d" % (zlib.crc32(key.encode()) % nbuckets,))
+
+def split_fa(fain, pool, delim, field, bar = None, nbuckets = None):
+	'''
+	Args:
+		fain (file): open fasta file.
+		pool (WriterPool): output writers.
+		delim (string): header field delimiter.
+		field (int): 0-indexed header field ID.
+		bar (FileProgress): optional progress bar.
+		nbuckets (int): write to key hash buckets instead of one output per
+			key, if set.
+
+	Return:
+		int: number of records.
+	'''
+	n = 0
+	for (head, seq) in fasta_entries(fain, bar):
+		key = header_key(head, delim, field)
+		if not nbuckets is None:
+			key = bucket_key(key, nbuckets)
+		pool.write(key, "%s\n%s\n" % (head, seq))
+		n += 1
+	return(n)
+
+def record_ranges(fname, n):
+	'''
+	Args:
+		fname (string): path to input fasta file.
+		n (int): number of ranges.
+
+	Return:
+		list: (start, end) byte ranges, each starting at a header line,
+		except for the first one.
+	'''
+
+	size = os.path.getsize(fname)
+	bounds = [0]
+	with open(fname, 'rb') as f:
+		for i in range(1, n):
+			f.seek(max(bounds[-1], size * i // n))
+			if 0 != f.tell():
+				# Skip the partial line
+				f.readline()
+			while True:
+				pos = f.tell()
+				line = f.readline()
+				if not line or line.startswith(b'>'):
+					break
+			bounds.append(pos)
+	bounds.append(size)
+	return([r for r in zip(bounds[:-1], bounds[1:]) if r[0] < r[1]])
+
+def range_lines(fname, start, end):
+	'''
+	Args:
+		fname (string): path to input file.
+		start (int): first byte of the range, at a line start.
+		end (int): end of the range, at a line start.
+
+	Yields:
+		string: the lines of the byte range.
+	'''
+	with open(fname, 'rb') as f:
+		f.seek(start)
+		pos = start
+		while pos < end:
+			line = f.readline()
+			if not line:
+				break
+			pos += len(line)
+			yield(line.decode())
+
+def split_range(chunk, fname, shard_root, delim, field, max_open, max_buffer,
+	ext = '.fa', nbuckets = None):
+	'''
+	Split a byte range of the input into a shard folder.
+
+	Args:
+		chunk (tuple): (index, start, end), from record_ranges.
+		fname (string): path to input fasta file.
+		shard_root (string): folder of the shard folders, one per range.
+		delim (string): header field delimiter.
+		field (int): 0-indexed header field ID.
+		max_open (int): maximum number of open files.
+		max_buffer (int): maximum buffered size in bytes.
+		ext (string): output extension.
+		nbuckets (int): number of key hash buckets, see split_fa.
+
+	Return:
+		tuple: (number of records, end of the range, keys of the shard
+		files).
+	'''
+
+	(i, start, end) = chunk
+	shard_dir = os.path.join(shard_root, "%d" % (i,))
+	os.mkdir(shard_dir)
+	pool = WriterPool(shard_dir, max_open, max_buffer, ext = ext)
+	n = split_fa(range_lines(fname, start, end), pool, delim, field,
+		nbuckets = nbuckets)
+	pool.close()
+	return((n, end, list(pool.started)))
+
+def merge_shards(keys, shard_dirs, outdir, ext = '.fa'):
+	'''
+	Concatenate the shard files of some keys, in range order.
+
+	Args:
+		keys (list): output keys.
+		shard_dirs (list): shard folders, in range order.
+		outdir (string): output folder.
+		ext (string): output extension.
+	'''
+
+	for key in keys:
+		with open("%s/%s%s" % (outdir, key, ext), 'wb') as fout:
+			for shard_dir in shard_dirs:
+				path = "%s/%s%s" % (shard_dir, key, ext)
+				if os.path.isfile(path):
+					with open(path, 'rb') as fin:
+						shutil.copyfileobj(fin, fout, 4 * 1024 * 1024)
+
+def parallel_split_fa(fname, outdir, delim, field, threads,
+	max_open = None, max_buffer = 64 * 1024 * 1024, bar = None, ext = '.fa',
+	nbuckets = None):
+	'''
+	Split a fasta file with worker processes, on byte ranges.
+
+	Args:
+		fname (string): path to input fasta file.
+		outdir (string): output folder.
+		delim (string): header field delimiter.
+		field (int): 0-indexed header field ID.
+		threads (int): number of worker processes.
+		max_open (int): maximum number of open files, over all workers.
+		max_buffer (int): maximum buffered size in bytes, over all workers.
+		bar (FileProgress): optional progress bar, updated per range.
+		ext (string): output extension.
+		nbuckets (int): number of key hash buckets, see split_fa.
+	'''
+
+	if max_open is None:
+		max_open = default_max_open()
+	max_open = max(1, max_open // threads)
+	max_buffer = max(1, max_buffer // threads)
+
+	# Shards on the same file system as the output
+	shard_root = tempfile.mkdtemp(prefix = '.split_fa.', dir = outdir)
+	chunks = [(i,) + r for (i, r) in enumerate(record_ranges(fname, threads))]
+	shard_dirs = [os.path.join(shard_root, "%d" % (c[0],)) for c in chunks]
+
+	try:
+		with ProcessPoolExecutor(max_workers = threads,
+			mp_context = multiprocessing.get_context('fork')) as pool:
+
+			# Split ranges
+			keys = set()
+			for (n, end, shard_keys) in pool.map(partial(split_range, fname = fname,
+				shard_root = shard_root, delim = delim, field = field,
+				max_open = max_open, max_buffer = max_buffer, ext = ext,
+				nbuckets = nbuckets), chunks):
+				keys.update(shard_keys)
+				if not bar is None:
+					bar.update(n, end)
+
+			# Merge shards, keys spread over the workers
+			keys = sorted(keys)
+			list(pool.map(partial(merge_shards, shard_dirs = shard_dirs,
+				outdir = outdir, ext = ext),
+				[keys[i::threads] for i in range(threads)]))
+	finally:
+		shutil.rmtree(shard_root)
+
+def index_path(fasta):
+	'''Path to the index of a grouped fasta file.'''
+	return("%s.idx" % (fasta,))
+
+def index_records(fname, delim, field):
+	'''
+	Args:
+		fname (string): path to fasta file, grouped by key.
+		delim (string): header field delimiter.
+		field (int): 0-indexed header field ID.
+
+	Return:
+		list: (key, byte offset, byte length, record count), in file order.
+	'''
+
+	index = []
+	seen = set()
+	key = None
+	with open(fname, 'rb') as f:
+		pos = 0
+		for line in f:
+			if line.startswith(b'>'):
+				curr_key = header_key(line.decode().strip(), delim, field)
+				if curr_key != key:
+					if curr_key in seen:
+						raise ValueError("records with key '%s' are not grouped."
+							% (curr_key,))
+					seen.add(curr_key)
+					if not key is None:
+						index[-1][2] = pos - index[-1][1]
+					index.append([curr_key, pos, 0, 0])
+					key = curr_key
+				index[-1][3] += 1
+			pos += len(line)
+		if not key is None:
+			index[-1][2] = pos - index[-1][1]
+	return([tuple(entry) for entry in index])
+
+def write_index(fasta, index):
+	'''
+	Args:
+		fasta (string): path to grouped fasta file.
+		index (list): from index_records.
+	'''
+	with open(index_path(fasta), 'w') as fout:
+		fout.write("".join(["%s\t%d\t%d\t%d\n" % entry for entry in index]))
+
+def index_buckets(fname, max_open = None, max_buffer = 64 * 1024 * 1024):
+	'''
+	Args:
+		fname (string): path to input fasta file.
+		max_open (int): maximum number of open files, None for default.
+		max_buffer (int): maximum buffered size in bytes.
+
+	Return:
+		int: number of key hash buckets, so that a bucket of a plain input
+		fits about max_buffer bytes, up to max_open buckets.
+	'''
+	if max_open is None:
+		max_open = default_max_open()
+	size = os.path.getsize(fname)
+	return(max(1, min(max_open, -(-size // max_buffer))))
+
+def write_grouped(bucket_dir, nbuckets, fasta, delim, field):
+	'''
+	Group the records of every bucket by key, in memory, and write them to a
+	single fasta file.
+
+	Args:
+		bucket_dir (string): folder with one <bucket>.fa file per bucket.
+		nbuckets (int): number of buckets.
+		fasta (string): path to output fasta file.
+		delim (string): header field delimiter.
+		field (int): 0-indexed header field ID.
+
+	Return:
+		list: (key, byte offset, byte length, record count), in file order,
+		as index_records.
+	'''
+
+	index = []
+	pos = 0
+	with open(fasta, 'wb') as fout:
+		for b in range(nbuckets):
+			path = "%s/%d.fa" % (bucket_dir, b)
+			if not os.path.isfile(path):
+				continue
+
+			# Records by key, in order of appearance
+			groups = OrderedDict()
+			with open(path, 'r') as fin:
+				for (head, seq) in fasta_entries(fin):
+					key = header_key(head, delim, field)
+					if not key in groups:
+						groups[key] = []
+					groups[key].append("%s\n%s\n" % (head, seq))
+
+			for (key, records) in groups.items():
+				data = "".join(records).encode()
+				fout.write(data)
+				index.append((key, pos, len(data), len(records)))
+				pos += len(data)
+	return(index)
+
+class FastaIndex(object):
+	'''Memory-mapped reader of a fasta file grouped by key, from its index.'''
+
+	def __init__(self, fasta):
+		'''
+		Args:
+			fasta (string): path to grouped fasta file, with index.
+		'''
+
+		self.index = OrderedDict()
+		with open(index_path(fasta), 'r') as f:
+			for line in f:
+				(key, offset, length, count) = line.rstrip('\n').split('\t')
+				self.index[key] = (int(offset), int(length), int(count))
+
+		self.f = open(fasta, 'rb')
+		if 0 == os.fstat(self.f.fileno()).st_size:
+			self.mm = b''
 		else:
-			curr_seq += row.strip()
-fain.close()
+			self.mm = mmap.mmap(self.f.fileno(), 0, access = mmap.ACCESS_READ)
+
+	def __len__(self):
+		return(len(self.index))
+
+	def __contains__(self, key):
+		return(key in self.index)
+
+	def keys(self):
+		'''Keys, in file order.'''
+		return(list(self.index.keys()))
+
+	def count(self, key):
+		'''Number of records of a key.'''
+		return(self.index[key][2])
+
+	def raw(self, key):
+		'''
+		Args:
+			key (string): record key.
+
+		Return:
+			memoryview: the fasta text of the records of key, without copies.
+		'''
+		(offset, length, count) = self.index[key]
+		return(memoryview(self.mm)[offset:(offset + length)])
+
+	def records(self, key):
+		'''
+		Args:
+			key (string): record key.
+
+		Yields:
+			tuple: (header, sequence) of the records of key.
+		'''
+		text = bytes(self.raw(key)).decode()
+		return(fasta_entries(text.splitlines(True)))
+
+	def close(self):
+		'''Release the memory map and the file.'''
+		if isinstance(self.mm, mmap.mmap):
+			self.mm.close()
+		self.f.close()
+
+# RUN ==========================================================================
+
+if __name__ == '__main__':
+
+	# Parse arguments
+	args = parse_arguments()
+
+	# Assign to in-script variables
+	fain_path = args.inFasta[0]
+	outdir = args.outdir[0]
+	delim = args.d[0]
+	field = args.f[0]
+	no_progress = args.no_progress
+	max_open = args.max_open[0]
+	max_buffer = args.buffer[0] * 1024 * 1024
+	threads = max(1, args.threads[0])
+
+	index = args.index
+	append = args.append
+	if args.compress[0] is None:
+		ext = '.fa'
+	else:
+		ext = '.fa.%s' % (args.compress[0],)
+
+	if index and os.path.exists(outdir) and os.path.samefile(fain_path, outdir):
+		# Index the input in place
+		if not compression(fain_path) is None:
+			print("ERROR: cannot index a compressed file in place.")
+			sys.exit(1)
+		try:
+			write_index(outdir, index_records(outdir, delim, field))
+		except ValueError as e:
+			print("ERROR: cannot index in place, %s" % (e,))
+			sys.exit(1)
+		sys.exit(0)
+	if index:
+		# Spill to key hash buckets, in a local temporary folder
+		fasta = outdir
+		outdir = tempfile.mkdtemp(prefix = '.split_fa.')
+		nbuckets = index_buckets(fain_path, max_open, max_buffer)
+	else:
+		nbuckets = None
+
+	# Create outdir if it does not exist
+	if not os.path.isdir(outdir):
+		os.mkdir(outdir)
 
-# Run last item
-d = split_fa(curr_head, curr_seq, d, only_once)
+	try:
+		with xopen(fain_path, 'r') as fain:
+			if 1 < threads:
+				# Split byte ranges in parallel, progress per range
+				bar = FileProgress(fain, no_progress, every = 1)
+				parallel_split_fa(fain_path, outdir, delim, field, threads,
+					max_open, max_buffer, bar, ext, nbuckets)
+			elif append:
+				bar = FileProgress(fain, no_progress)
+				pool = WriterPool(outdir, max_open, max_buffer, mode = 'a',
+					ext = ext)
+				split_fa_by_gene(fain, pool, bar)
+				pool.close()
+			else:
+				bar = FileProgress(fain, no_progress)
+				pool = WriterPool(outdir, max_open, max_buffer, ext = ext)
+				split_fa(fain, pool, delim, field, bar, nbuckets)
+				pool.close()
+			bar.finish()
 
-if only_once:
-	# Write final output
-	for k in d.keys():
-		fout = open("%s/%s.fa" % (outdir, k), 'w+')
-		fout.write(d[k])
-		fout.close()
+		if index:
+			# Group buckets by key, indexing while writing
+			write_index(fasta, write_grouped(outdir, nbuckets, fasta,
+				delim, field))
+			print(" >>> Indexed %s in %s." % (fasta, index_path(fasta)))
+	finally:
+		if index:
+			shutil.rmtree(outdir)
 
-# END ==========================================================================
+	# END ======================================================================
 
 ################################################################################
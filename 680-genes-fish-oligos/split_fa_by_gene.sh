@@ -8,14 +8,10 @@
 # Note:
 # 	- works only if no space is present in the fasta headers
 # 	- as sequences are appended, remove previous run outputs when re-running
+# 	- delegates to split_fa.py --append, with the same output
 # 
 
 outdir=$2
 mkdir -p $outdir
 
-while IFS='' read -r line || [[ -n "$line" ]]; do
-	if [ ${line:0:1} == '>' ]; then
-    	name=$(echo "$line" | sed 's/^>\ //' | tr '_' ' ' | cut -d ' ' -f 1)
-    	echo -e "$line" | tr '\t' '\n' >> $outdir"/"$name".fa"
-    fi
-done < <(cat "$1" | paste - -)
+python3 "$(dirname "$0")/split_fa.py" --append --no-progress "$1" "$outdir"
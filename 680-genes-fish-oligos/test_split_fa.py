@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# ------------------------------------------------------------------------------
+# 
+# Author: Gabriele Girelli
+# Email: gigi.ga90@gmail.com
+# Version: 1.0.0
+# Date: 20170724
+# Project: 680 genes
+# Description:	regression tests for split_fa.py, run with pytest.
+# 
+# ------------------------------------------------------------------------------
+
+
+
+# DEPENDENCIES =================================================================
+
+import os
+import subprocess
+import sys
+
+from split_fa import FastaIndex
+
+# PARAMETERS ===================================================================
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'split_fa.py')
+
+# FUNCTIONS ====================================================================
+
+def test_index_records_empty_sequence(tmp_path):
+	'''Records with an empty sequence are read back from a grouped fasta.'''
+	fain = tmp_path / 'in.fa'
+	fain.write_text(">A_1:x\n>A_2:y\nGGCC\n")
+	fasta = str(tmp_path / 'out.fa')
+
+	subprocess.run([sys.executable, SCRIPT, '--no-progress', '--index',
+		str(fain), fasta], check = True, stdout = subprocess.DEVNULL)
+
+	idx = FastaIndex(fasta)
+	try:
+		assert 2 == idx.count('A')
+		assert [('>A_1:x', ''), ('>A_2:y', 'GGCC')] == list(idx.records('A'))
+	finally:
+		idx.close()
+
+# END ==========================================================================
+
+################################################################################
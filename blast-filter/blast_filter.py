@@ -5,7 +5,7 @@
 # 
 # Author: Gabriele Girelli
 # Email: gigi.ga90@gmail.com
-# Version: 1.2.1
+# Version: 1.8.1
 # Date: 20170724
 # Project: RNA FISH oligo design
 # Description:	filter BLASTN output based on:
@@ -17,6 +17,7 @@
 # 		PM: Perfect Match.
 # 		OT: Off Target.
 # 		The script should be run on single-gene outputs.
+# 		Inputs and output can be compressed (.gz, .bgz, .zst), by extension.
 # 		
 # @TODO:
 # 	Include BioMaRt so that the geneTranscriptTable is not needed anymore.
@@ -26,6 +27,13 @@
 # 		1.1.0: added argparser support.
 # 		1.2.0: changed saturation OT filter.
 # 		1.2.1: fixed exception triggered when no OT are found.
+# 		1.3.0: single-pass, set-based filtering core.
+# 		1.4.0: added columnar (pandas) mode.
+# 		1.5.0: streaming FASTA output, with optional gzip compression.
+# 		1.6.0: added support for binary hit stores (blast_store.py).
+# 		1.7.0: added threshold sweep mode.
+# 		1.8.0: compressed inputs and output, by extension.
+# 		1.8.1: sweep outputs end in .gz with --gzip.
 # 
 # ------------------------------------------------------------------------------
 
@@ -34,159 +42,135 @@
 # DEPENDENCIES =================================================================
 
 import argparse
+from collections import Counter
+import gzip
 import numpy as np
+import os
+import pandas as pd
 
-# PARAMETERS ===================================================================
-
+from blast_store import load_store, select_hits
+from compressed_io import COMPRESSION_EXT, compression, xopen
 
-# Add script description
-parser = argparse.ArgumentParser(
-	description = 'Filter BLASTN output.'
-)
-
-# Add mandatory arguments
-parser.add_argument('blastInput', type = str, nargs = 1,
-	help = 'Path to BLAST input fasta file.')
-parser.add_argument('blastOutput', type = str, nargs = 1,
-	help = 'Path to BLAST output with outfmt 6.')
-parser.add_argument('geneTranscriptTable', type = str, nargs = 1,
-	help = """Path to table with TRANSCRIPT_ID:GENE_SYMBOL
-	tabulation-separated columns.""", default = [30])
-parser.add_argument('output', type = str, nargs = 1,
-	help = 'Path to output fasta file, after filtering.')
-
-# Add arguments with default value
-parser.add_argument('-k', type = int, nargs = 1,
-	metavar = 'k', help = """Oligonucleotide length in nt.
-	Default: 30.""", default = [30])
-parser.add_argument('-t', '--homology-thr', type = float, nargs = 1,
-	metavar = 'ht', help = """Threshold on maximum homology, as fraction of k.
-	Accepts float values from 0 to 1.
-	Default: .85""", default = [.85])
-parser.add_argument('-g', '--gene-thr', type = int, nargs = 1,
-	metavar = 'gt', help = """Threshold on the number of off-targets gene,
-	for a single oligo.
-	Default: 20""", default = [20])
-parser.add_argument('-s', '--saturation-thr', type = int, nargs = 1,
-	metavar = 'st', help = """
-	Threshold on the number of oligos off-targeting a gene,
-	for the selections of 'saturated' off-target genes. Oligos targeting
-	a saturated off-target are filtered out.
-	Default: 5""", default = [5])
-
-# Parse arguments
-args = parser.parse_args()
-
-# Assign to in-script variables
-blast_input = args.blastInput[0]
-blast_output = args.blastOutput[0]
-gene_transcript_table = args.geneTranscriptTable[0]
-output_file = args.output[0]
-k = args.k[0]
-homThr = args.homology_thr[0]
-gene_ot_thr = args.gene_thr[0]
-oligo_ot_thr = args.saturation_thr[0]
-
-# Log to screen the settings
-print("""
-Settings:
-              BLASTN input : %s
-             BLASTN output : %s
-     Gene-Transcript table : %s
-               Output file : %s
-                         K : %d
-        Homology threshold : %f
-       Gene Off-Target thr : %d
- Off-Target saturation thr : %d
-
-""" % (blast_input, blast_output, gene_transcript_table, output_file,
-	k, homThr, gene_ot_thr, oligo_ot_thr))
+# PARAMETERS ===================================================================
 
+def parse_arguments():
+	'''Parse command line arguments.'''
+
+	# Add script description
+	parser = argparse.ArgumentParser(
+		description = 'Filter BLASTN output.'
+	)
+
+	# Add mandatory arguments
+	parser.add_argument('blastInput', type = str, nargs = 1,
+		help = 'Path to BLAST input fasta file.')
+	parser.add_argument('blastOutput', type = str, nargs = 1,
+		help = """Path to BLAST output with outfmt 6, or to a hit store folder
+		built with blast_store.py.""")
+	parser.add_argument('geneTranscriptTable', type = str, nargs = 1,
+		help = """Path to table with TRANSCRIPT_ID:GENE_SYMBOL
+		tabulation-separated columns.""", default = [30])
+	parser.add_argument('output', type = str, nargs = 1,
+		help = 'Path to output fasta file, after filtering.')
+
+	# Add arguments with default value
+	parser.add_argument('-k', type = int, nargs = 1,
+		metavar = 'k', help = """Oligonucleotide length in nt.
+		Default: 30.""", default = [30])
+	parser.add_argument('-t', '--homology-thr', type = float, action = 'append',
+		metavar = 'ht', help = """Threshold on maximum homology, as fraction of k.
+		Accepts float values from 0 to 1. Repeat to sweep.
+		Default: .85""")
+	parser.add_argument('-g', '--gene-thr', type = int, action = 'append',
+		metavar = 'gt', help = """Threshold on the number of off-targets gene,
+		for a single oligo. Repeat to sweep.
+		Default: 20""")
+	parser.add_argument('-s', '--saturation-thr', type = int, action = 'append',
+		metavar = 's', help = """
+		Threshold on the number of oligos off-targeting a gene,
+		for the selections of 'saturated' off-target genes. Oligos targeting
+		a saturated off-target are filtered out. Repeat to sweep.
+		Default: 5""")
+	parser.add_argument('--chunksize', type = int, nargs = 1,
+		metavar = 'cs', help = """
+		Number of BLASTN output rows per chunk, in columnar mode.
+		Default: 1000000""", default = [1000000])
+
+	# Add flags
+	parser.add_argument('--columnar',
+		action = 'store_const', dest = 'columnar',
+		const = True, default = False,
+		help = """Load the BLASTN output in chunks of typed columns and filter
+		with vectorized group-by reductions.""")
+	parser.add_argument('--gzip',
+		action = 'store_const', dest = 'gzip_output',
+		const = True, default = False,
+		help = """Write gzip-compressed FASTA output. Sweep outputs get a .gz
+		extension, if not already gzip-compressed by extension.""")
+
+	# Parse arguments
+	args = parser.parse_args()
+
+	# Default thresholds
+	if args.homology_thr is None:
+		args.homology_thr = [.85]
+	if args.gene_thr is None:
+		args.gene_thr = [20]
+	if args.saturation_thr is None:
+		args.saturation_thr = [5]
+
+	return(args)
 
 # FUNCTIONS ====================================================================
 
-# RUN ==========================================================================
-print("Run:")
-
-# Build TRANSCRIPT_ID:GENE_SYMBOL dictionary -----------------------------------
-print(" · Building TRANSCRIPT_ID:GENE_SYMBOL dictionary...")
-
-# Initialize empty TRANSCRIPT_ID:GENE_SYMBOL dictionary
-trn_gene_dict = {}
-
-# Read table line by line
-with open(gene_transcript_table) as gttf:
-	for line in gttf:
-
-		# Split every line in two fields
-		tmp = line.strip().split('\t')
-
-		# Store key,value couples in the dictionary
-		trn_gene_dict[tmp[0]] = tmp[1]
+def read_trn_gene_dict(gene_transcript_table):
+	'''
+	Args:
+		gene_transcript_table (string): path to TRANSCRIPT_ID:GENE_SYMBOL table.
 
-# Work on BLASTN output --------------------------------------------------------
+	Return:
+		dict: TRANSCRIPT_ID:GENE_SYMBOL dictionary.
+	'''
 
-# Filter based on max homology
-# ----------------------------
-print(" · Filtering based on maximum homology...")
+	# Initialize empty TRANSCRIPT_ID:GENE_SYMBOL dictionary
+	trn_gene_dict = {}
 
-# Initalize empty maximum homology dictionary
-max_homology = {}
+	# Read table line by line
+	with xopen(gene_transcript_table) as gttf:
+		for line in gttf:
 
-# Read table line by line
-with open(blast_output) as bof:
-	for line in bof:
+			# Split every line in two fields
+			tmp = line.strip().split('\t')
 
-		# Split every line by column
-		tmp = line.strip().split('\t')
+			# Store key,value couples in the dictionary
+			trn_gene_dict[tmp[0]] = tmp[1]
 
-		# Identify oligomer ID
-		OID = tmp[0].split(':')[0]
+	return(trn_gene_dict)
 
-		# Identify target gene
-		target = tmp[0].split('_')[0]
+def read_blast_output(blast_output, trn_gene_dict, k, homThr):
+	'''
+	Read the BLASTN output once, collecting for every oligo its maximum
+	off-target homology and its off-target hits above homThr.
 
-		# Identify transcript ID
-		transcript = tmp[1].split('.')[0]
+	Args:
+		blast_output (string): path to BLASTN output with outfmt 6.
+		trn_gene_dict (dict): TRANSCRIPT_ID:GENE_SYMBOL dictionary.
+		k (int): oligo length in nt.
+		homThr (float): homology threshold, as fraction of k.
 
-		# Calculate homology
-		homology = (int(tmp[3]) - int(tmp[4])) / float(k)
+	Return:
+		tuple: (max_homology, ot_dict). max_homology maps every oligo ID to
+		its maximum off-target homology (0 if no off-target). ot_dict maps
+		every oligo ID with off-targets above homThr to a Counter of
+		(OTgene, OTtranscript) hits.
+	'''
 
-		# If it is an off-target
-		if target != trn_gene_dict[transcript]:
-			if not OID in max_homology.keys():
-				max_homology[OID] = homology
-			else:
-				# With homology higher than the threshold
-				if homology > max_homology[OID]:
-					max_homology[OID] = homology
-		elif not OID in max_homology.keys():
-			max_homology[OID] = 0
-
-# Identify oligos that pass the threshold
-pass_homology = []
-for OID in max_homology.keys():
-	if max_homology[OID] < homThr:
-		pass_homology.append(OID)
-
-# Log
-print(" >>> %d oligos do not have any off-targets." % (len(pass_homology),))
-print(" >>> %d oligos have off-targets." % (len(max_homology)-len(pass_homology),))
-print(" >>> Saving off-target free oligos. Analyzing further the rest.")
-
-if 0 == len(max_homology)-len(pass_homology):
-	print(" · Skipping subsequent filter steps...")
-else:
-	# Check off target location
-	# -------------------------
-	print(" · Identifying off-target locations...")
-
-	# Initialize empty off-targets dictionary
-	# OligoID:OTgene:OTtranscript
+	# Initalize empty maximum homology and off-target dictionaries
+	max_homology = {}
 	ot_dict = {}
 
 	# Read table line by line
-	with open(blast_output) as bof:
+	with xopen(blast_output) as bof:
 		for line in bof:
 
 			# Split every line by column
@@ -195,50 +179,186 @@ else:
 			# Identify oligomer ID
 			OID = tmp[0].split(':')[0]
 
-			# Work only on oligos with off-targets
-			# that do not pass the homology filter
-			if OID in pass_homology:
-				continue
-
 			# Identify target gene
 			target = tmp[0].split('_')[0]
 
 			# Identify transcript ID
-			ot_trans = tmp[1].split('.')[0]
+			transcript = tmp[1].split('.')[0]
+
+			# Identify the (off-)target
+			ot_gene = trn_gene_dict[transcript]
 
 			# Calculate homology
 			homology = (int(tmp[3]) - int(tmp[4])) / float(k)
 
-			# Identify the off-target
-			ot_gene = trn_gene_dict[ot_trans]
-
-			# If it is an off-target
-			if target != ot_gene:
-
-				# With homology higher than the threshold
-				if homology >= homThr:
-
-					if not OID in ot_dict.keys():
-						ot_dict[OID] = {}
-						ot_dict[OID][ot_gene] = {}
-						ot_dict[OID][ot_gene][ot_trans] = 1
-					else:
-						if not ot_gene in ot_dict[OID].keys():
-							ot_dict[OID][ot_gene] = {}
-							ot_dict[OID][ot_gene][ot_trans] = 1
-						else:
-							if not ot_trans in ot_dict[OID][ot_gene].keys():
-								ot_dict[OID][ot_gene][ot_trans] = 1
-							else:
-								ot_dict[OID][ot_gene][ot_trans] += 1
+			# If it is not an off-target
+			if target == ot_gene:
+				max_homology.setdefault(OID, 0)
+				continue
 
-	# Calculate number of off-targets
-	# -------------------------------
-	print(" · Filtering based on number of off-target genes...")
+			# Update maximum homology
+			if homology > max_homology.get(OID, homology - 1):
+				max_homology[OID] = homology
+
+			# With homology higher than the threshold
+			if homology >= homThr:
+				if not OID in ot_dict:
+					ot_dict[OID] = Counter()
+				ot_dict[OID][(ot_gene, transcript)] += 1
+
+	return((max_homology, ot_dict))
+
+def read_blast_output_columnar(blast_output, trn_gene_dict, k, homThr,
+	chunksize, keep_homology = False):
+	'''
+	Columnar counterpart of read_blast_output: the BLASTN output is loaded in
+	chunks of typed columns and reduced with group-by operations.
+
+	Args:
+		blast_output (string): path to BLASTN output with outfmt 6.
+		trn_gene_dict (dict): TRANSCRIPT_ID:GENE_SYMBOL dictionary.
+		k (int): oligo length in nt.
+		homThr (float): homology threshold, as fraction of k.
+		chunksize (int): number of rows per chunk.
+		keep_homology (bool): count hits separately per homology value.
+
+	Return:
+		tuple: (max_homology, ot_hits). max_homology is a Series with the
+		maximum off-target homology of every oligo ID (0 if no off-target).
+		ot_hits is a DataFrame with one row per oligo ID, OTgene code and
+		OTtranscript code (and homology, if keep_homology) with homology above
+		homThr, and the number of hits.
+	'''
+
+	# Hit grouping columns
+	hit_cols = ['oid', 'gene', 'transcript']
+	if keep_homology:
+		hit_cols.append('homology')
+
+	# Categorical TRANSCRIPT_ID:GENE_SYMBOL index
+	trn_index = pd.Index(list(trn_gene_dict.keys()))
+	genes = pd.Categorical(list(trn_gene_dict.values()))
+	trn_gene_codes = genes.codes
+	gene_index = genes.categories
+
+	max_parts = []
+	hit_parts = []
+
+	blast_file = xopen(blast_output)
+	try:
+		reader = pd.read_csv(blast_file, sep = '\t', header = None,
+			usecols = [0, 1, 3, 4], chunksize = chunksize,
+			dtype = {0 : 'category', 1 : 'category', 3 : np.int32, 4 : np.int32})
+		for chunk in reader:
+
+			# Identify oligomer ID and target gene, once per distinct query
+			queries = chunk[0].cat.categories
+			qcodes = chunk[0].cat.codes.values
+			oid = np.asarray(queries.str.split(':').str[0], dtype = object)[qcodes]
+			target = gene_index.get_indexer(queries.str.split('_').str[0])[qcodes]
+
+			# Identify transcript ID and gene, once per distinct subject
+			subjects = chunk[1].cat.categories.str.split('.').str[0]
+			trn_pos = trn_index.get_indexer(subjects)
+			if (trn_pos < 0).any():
+				raise KeyError(subjects[trn_pos < 0][0])
+			transcript = trn_pos[chunk[1].cat.codes.values]
+			ot_gene = trn_gene_codes[transcript]
+
+			# Calculate homology
+			homology = (chunk[3].values - chunk[4].values) / float(k)
+
+			# Off-target homology (0 for correct targets)
+			is_ot = target != ot_gene
+			max_parts.append(pd.Series(np.where(is_ot, homology, 0),
+				index = oid).groupby(level = 0).max())
+
+			# Off-targets with homology higher than the threshold
+			is_hit = is_ot & (homology >= homThr)
+			hit_parts.append(pd.DataFrame({
+				'oid' : oid[is_hit],
+				'gene' : ot_gene[is_hit],
+				'transcript' : transcript[is_hit],
+				'homology' : homology[is_hit]
+			}).groupby(hit_cols).size())
+	except pd.errors.EmptyDataError:
+		pass
+	finally:
+		blast_file.close()
+
+	if 0 == len(max_parts):
+		return((pd.Series(dtype = float), pd.DataFrame(
+			columns = hit_cols + ['n'])))
+
+	# Merge chunks
+	max_homology = pd.concat(max_parts).groupby(level = 0).max()
+	ot_hits = pd.concat(hit_parts).groupby(
+		level = list(range(len(hit_cols)))).sum()
+	ot_hits = ot_hits.rename('n').reset_index()
+
+	return((max_homology, ot_hits))
+
+def read_blast_store(store_path, blast_input, k, homThr,
+	keep_homology = False):
+	'''
+	Store counterpart of read_blast_output_columnar: only the hits of the
+	oligos in the BLASTN input are read from the memory-mapped store.
+
+	Args:
+		store_path (string): path to hit store folder.
+		blast_input (string): path to BLASTN input fasta file.
+		k (int): oligo length in nt.
+		homThr (float): homology threshold, as fraction of k.
+		keep_homology (bool): count hits separately per homology value.
+
+	Return:
+		tuple: (max_homology, ot_hits), as read_blast_output_columnar.
+	'''
+
+	# Hit grouping columns
+	hit_cols = ['oid', 'gene', 'transcript']
+	if keep_homology:
+		hit_cols.append('homology')
+
+	# Identify oligos of the BLASTN input
+	oligo_ids = set()
+	with xopen(blast_input) as bif:
+		for line in bif:
+			if '>' == line[0]:
+				oligo_ids.add(line[1:].split(':')[0])
+
+	# Retrieve their hits
+	(ids, owner, transcript, gene, target, matches) = select_hits(
+		load_store(store_path), oligo_ids)
+	oid = ids.astype(object)[owner]
+
+	# Calculate homology
+	homology = matches / float(k)
+
+	# Off-target homology (0 for correct targets)
+	is_ot = target != gene
+	max_homology = pd.Series(np.where(is_ot, homology, 0),
+		index = oid).groupby(level = 0).max()
+
+	# Off-targets with homology higher than the threshold
+	is_hit = is_ot & (homology >= homThr)
+	ot_hits = pd.DataFrame({
+		'oid' : oid[is_hit],
+		'gene' : gene[is_hit],
+		'transcript' : transcript[is_hit],
+		'homology' : homology[is_hit]
+	}).groupby(hit_cols).size()
+	ot_hits = ot_hits.rename('n').reset_index()
+
+	return((max_homology, ot_hits))
+
+def print_ot_summary(counts, gene_ot_thr):
+	'''
+	Args:
+		counts (list): number of off-target genes per oligo.
+		gene_ot_thr (int): threshold on the number of off-target genes.
+	'''
 
-	ot_gene_count = {}
-	for OID in ot_dict.keys():
-		ot_gene_count[OID] = len(ot_dict[OID].keys())
 	print(""" >>> OT counts summary:
 	             min : %f
 	      1st Quart. : %f
@@ -247,22 +367,55 @@ else:
 	      2nd Quart. : %f
 	             max : %f
 	 >>> Current threshold at the %d-ith percentile.""" % (
-		np.percentile(ot_gene_count.values(), 0),
-		np.percentile(ot_gene_count.values(), 25),
-		np.percentile(ot_gene_count.values(), 50),
-		np.mean(ot_gene_count.values()),
-		np.percentile(ot_gene_count.values(), 75),
-		np.percentile(ot_gene_count.values(), 100),
-		int(sum(np.array(ot_gene_count.values()) < gene_ot_thr)
-			/ float(len(ot_gene_count.values())) * 100)
+		np.percentile(counts, 0),
+		np.percentile(counts, 25),
+		np.percentile(counts, 50),
+		np.mean(counts),
+		np.percentile(counts, 75),
+		np.percentile(counts, 100),
+		int(sum(np.array(counts) < gene_ot_thr) / float(len(counts)) * 100)
 	))
 
+def filter_oligos(max_homology, ot_dict, homThr, gene_ot_thr, oligo_ot_thr):
+	'''
+	Args:
+		max_homology (dict): maximum off-target homology per oligo.
+		ot_dict (dict): Counter of (OTgene, OTtranscript) hits per oligo.
+		homThr (float): homology threshold, as fraction of k.
+		gene_ot_thr (int): threshold on the number of off-target genes.
+		oligo_ot_thr (int): threshold on the number of oligos per off-target.
+
+	Return:
+		set: IDs of the oligos passing all the filters.
+	'''
+
+	# Identify oligos that pass the threshold
+	pass_homology = set(OID for (OID, homology) in max_homology.items()
+		if homology < homThr)
+
+	# Log
+	print(" >>> %d oligos do not have any off-targets." % (len(pass_homology),))
+	print(" >>> %d oligos have off-targets." % (
+		len(max_homology)-len(pass_homology),))
+	print(" >>> Saving off-target free oligos. Analyzing further the rest.")
+
+	if 0 == len(max_homology)-len(pass_homology):
+		print(" · Skipping subsequent filter steps...")
+		return(pass_homology)
+
+	# Calculate number of off-targets
+	# -------------------------------
+	print(" · Filtering based on number of off-target genes...")
+
+	ot_gene_count = dict((OID, len(set(gene for (gene, trans) in ot_dict[OID])))
+		for OID in ot_dict)
+	print_ot_summary(list(ot_gene_count.values()), gene_ot_thr)
+
 	# Filter based on number of OTs per oligo
-	pass_oligo_ot_count = []
-	for OID in ot_gene_count.keys():
-		if ot_gene_count[OID] < gene_ot_thr:
-			pass_oligo_ot_count.append(OID)
-	print(" >>> %d oligos pass the OT count filter" % (len(pass_oligo_ot_count),))
+	pass_oligo_ot_count = set(OID for (OID, count) in ot_gene_count.items()
+		if count < gene_ot_thr)
+	print(" >>> %d oligos pass the OT count filter" % (
+		len(pass_oligo_ot_count),))
 
 	# Calculate number of common off-targets
 	# --------------------------------------
@@ -274,76 +427,372 @@ else:
 	else:
 		print(" · Filtering based on saturated off-target transcripts...")
 
-		gene_ot_count = {}
+		# Count hits per off-target transcript
+		gene_ot_count = Counter()
 		for OID in pass_oligo_ot_count:
-			for gene in ot_dict[OID].keys():
-				if not gene in gene_ot_count.keys():
-					gene_ot_count[gene] = ot_dict[OID][gene]
-				else:
-					for trans in ot_dict[OID][gene].keys():
-						if not trans in gene_ot_count[gene].keys():
-							gene_ot_count[gene][trans] = ot_dict[OID][gene][trans]
-						else:
-							gene_ot_count[gene][trans] += ot_dict[OID][gene][trans]
-
-		# Filter based on number of OTs per transcript
-		for gene in gene_ot_count.keys():
-			for trans in gene_ot_count[gene].keys():
-				# Discard oligos that off-target a transcript
-				# shared by too many oligos
-				if gene_ot_count[gene][trans] >= oligo_ot_thr:
-					for OID in pass_gene_ot_count:
-						if gene in ot_dict[OID].keys():
-							if trans in ot_dict[OID][gene].keys():
-								pass_gene_ot_count.remove(OID)
+			gene_ot_count.update(ot_dict[OID])
+
+		# Identify transcripts shared by too many oligos
+		saturated = set(ot for (ot, count) in gene_ot_count.items()
+			if count >= oligo_ot_thr)
+
+		# Discard oligos that off-target a saturated transcript
+		pass_gene_ot_count = set(OID for OID in pass_oligo_ot_count
+			if saturated.isdisjoint(ot_dict[OID]))
 
 		print(" >>> %d oligos pass the saturation OT filter"
 			% (len(pass_gene_ot_count),))
 
-# Merge list of filtered oligos
-# -----------------------------
+	# Merge sets of filtered oligos
+	return(pass_homology | pass_gene_ot_count)
+
+def filter_oligos_columnar(max_homology, ot_hits,
+	homThr, gene_ot_thr, oligo_ot_thr):
+	'''
+	Columnar counterpart of filter_oligos.
+
+	Args:
+		max_homology (pd.Series): maximum off-target homology per oligo.
+		ot_hits (pd.DataFrame): off-target hits, from read_blast_output_columnar.
+		homThr (float): homology threshold, as fraction of k.
+		gene_ot_thr (int): threshold on the number of off-target genes.
+		oligo_ot_thr (int): threshold on the number of oligos per off-target.
+
+	Return:
+		set: IDs of the oligos passing all the filters.
+	'''
 
-output_list = pass_homology
-if 0 != len(max_homology)-len(output_list):
-	output_list.extend(pass_gene_ot_count)
-output_list.sort()
+	# Identify oligos that pass the threshold
+	pass_homology = set(max_homology.index[max_homology.values < homThr])
 
-# Log
-print(" · %d oligos can be used for further screening." % (len(output_list),))
+	# Log
+	print(" >>> %d oligos do not have any off-targets." % (len(pass_homology),))
+	print(" >>> %d oligos have off-targets." % (
+		len(max_homology)-len(pass_homology),))
+	print(" >>> Saving off-target free oligos. Analyzing further the rest.")
 
-# Prepare output ---------------------------------------------------------------
-print(" · Generating FASTA output...")
+	if 0 == len(max_homology)-len(pass_homology):
+		print(" · Skipping subsequent filter steps...")
+		return(pass_homology)
 
-# Prepare output string
-s = ''
+	# Calculate number of off-targets
+	# -------------------------------
+	print(" · Filtering based on number of off-target genes...")
 
-# Variable to keep the non-header lines
-keep = False
+	ot_gene_count = ot_hits.groupby('oid')['gene'].nunique()
+	print_ot_summary(ot_gene_count.values, gene_ot_thr)
 
-# Read Fasta line by line
-with open(blast_input) as bif:
-	for line in bif:
+	# Filter based on number of OTs per oligo
+	pass_oligo_ot_count = set(
+		ot_gene_count.index[ot_gene_count.values < gene_ot_thr])
+	print(" >>> %d oligos pass the OT count filter" % (
+		len(pass_oligo_ot_count),))
 
-		# If header line
-		if '>' == line[0]:
-			# Check if the sequence should be kept
-			if line[1:].split(':')[0] in output_list:
-				keep = True
-				s += line
-			else:
-				keep = False
-		# Otherwise keep it if it passed the filters
-		elif keep:
-			s += line
+	# Calculate number of common off-targets
+	# --------------------------------------
 
-# Write output
-f = open(output_file, 'w')
-f.write(s)
-f.close()
+	pass_gene_ot_count = pass_oligo_ot_count
+
+	if 1 == len(pass_oligo_ot_count):
+		print(" · Skipping saturated off-target transcript filter...")
+	else:
+		print(" · Filtering based on saturated off-target transcripts...")
+
+		# Count hits per off-target transcript
+		ot_hits = ot_hits[ot_hits['oid'].isin(pass_oligo_ot_count)]
+		trn_ot_count = ot_hits.groupby('transcript')['n'].sum()
+
+		# Identify transcripts shared by too many oligos
+		saturated = trn_ot_count.index[trn_ot_count.values >= oligo_ot_thr]
+
+		# Discard oligos that off-target a saturated transcript
+		pass_gene_ot_count = pass_oligo_ot_count - set(
+			ot_hits.loc[ot_hits['transcript'].isin(saturated), 'oid'])
+
+		print(" >>> %d oligos pass the saturation OT filter"
+			% (len(pass_gene_ot_count),))
+
+	# Merge sets of filtered oligos
+	return(pass_homology | pass_gene_ot_count)
+
+def write_output(blast_input, output_file, output_ids, gzip_output = False):
+	'''
+	Stream the kept records of the BLASTN input to the output fasta file.
+
+	Args:
+		blast_input (string): path to BLASTN input fasta file.
+		output_file (string): path to output fasta file.
+		output_ids (set): IDs of the oligos to be kept.
+		gzip_output (bool): compress the output with gzip, regardless of its
+			extension.
+	'''
+
+	# Variable to keep the non-header lines
+	keep = False
+
+	# Point to output file
+	if gzip_output:
+		bof = gzip.open(output_file, 'wt')
+	else:
+		bof = xopen(output_file, 'w', buffering = 1024 * 1024)
+
+	# Read Fasta line by line
+	with xopen(blast_input) as bif, bof:
+		for line in bif:
+
+			# If header line, check if the sequence should be kept
+			if '>' == line[0]:
+				keep = line[1:].split(':')[0] in output_ids
+
+			# Write it if it passed the filters
+			if keep:
+				bof.write(line)
+
+def print_settings(blast_input, blast_output, gene_transcript_table,
+	output_file, k, homThr, gene_ot_thr, oligo_ot_thr, columnar,
+	gzip_output = False):
+	'''Log to screen the settings.'''
+
+	print("""
+Settings:
+              BLASTN input : %s
+             BLASTN output : %s
+     Gene-Transcript table : %s
+               Output file : %s
+                         K : %d
+        Homology threshold : %f
+       Gene Off-Target thr : %d
+ Off-Target saturation thr : %d
+             Columnar mode : %r
+               Gzip output : %r
+
+""" % (blast_input, blast_output, gene_transcript_table, output_file,
+		k, homThr, gene_ot_thr, oligo_ot_thr, columnar, gzip_output))
+
+def run_filter(blast_input, blast_output, trn_gene_dict, output_file,
+	k, homThr, gene_ot_thr, oligo_ot_thr, columnar, chunksize,
+	gzip_output = False):
+	'''
+	Filter the BLASTN output of a single gene and write the passing oligos.
+
+	Args:
+		blast_input (string): path to BLASTN input fasta file.
+		blast_output (string): path to BLASTN output with outfmt 6, or to
+			hit store folder.
+		trn_gene_dict (dict): TRANSCRIPT_ID:GENE_SYMBOL dictionary, not
+			needed for hit stores.
+		output_file (string): path to output fasta file.
+		k (int): oligo length in nt.
+		homThr (float): homology threshold, as fraction of k.
+		gene_ot_thr (int): threshold on the number of off-target genes.
+		oligo_ot_thr (int): threshold on the number of oligos per off-target.
+		columnar (bool): use the columnar (pandas) mode.
+		chunksize (int): number of rows per chunk, in columnar mode.
+		gzip_output (bool): compress the output with gzip.
+	'''
+
+	# Work on BLASTN output ----------------------------------------------------
+	print(" · Filtering based on maximum homology...")
+	if os.path.isdir(blast_output):
+		(max_homology, ot_hits) = read_blast_store(
+			blast_output, blast_input, k, homThr)
+		output_ids = filter_oligos_columnar(max_homology, ot_hits,
+			homThr, gene_ot_thr, oligo_ot_thr)
+	elif columnar:
+		(max_homology, ot_hits) = read_blast_output_columnar(
+			blast_output, trn_gene_dict, k, homThr, chunksize)
+		output_ids = filter_oligos_columnar(max_homology, ot_hits,
+			homThr, gene_ot_thr, oligo_ot_thr)
+	else:
+		(max_homology, ot_dict) = read_blast_output(
+			blast_output, trn_gene_dict, k, homThr)
+		output_ids = filter_oligos(max_homology, ot_dict,
+			homThr, gene_ot_thr, oligo_ot_thr)
+
+	# Log
+	print(" · %d oligos can be used for further screening." % (
+		len(output_ids),))
+
+	# Prepare output -----------------------------------------------------------
+	print(" · Generating FASTA output...")
+	write_output(blast_input, output_file, output_ids, gzip_output)
+
+def split_output_path(output_file):
+	'''
+	Args:
+		output_file (string): path to output fasta file.
+
+	Return:
+		tuple: (root, extension), keeping a compression suffix (e.g., .gz) in
+		the extension.
+	'''
+
+	(root, ext) = os.path.splitext(output_file)
+	if ext in COMPRESSION_EXT:
+		(root, ext0) = os.path.splitext(root)
+		ext = ext0 + ext
+	return((root, ext))
+
+def sweep_output_path(output_file, homThr, gene_ot_thr, oligo_ot_thr):
+	'''
+	Args:
+		output_file (string): path to output fasta file.
+		homThr (float): homology threshold, as fraction of k.
+		gene_ot_thr (int): threshold on the number of off-target genes.
+		oligo_ot_thr (int): threshold on the number of oligos per off-target.
+
+	Return:
+		string: output_file, tagged with the thresholds. E.g., out.fa with
+		.85, 20 and 5 becomes out.85homPerc.20ot.5sl.fa.
+	'''
+
+	(root, ext) = split_output_path(output_file)
+	return("%s.%ghomPerc.%dot.%dsl%s" % (root, round(homThr * 100, 6),
+		gene_ot_thr, oligo_ot_thr, ext))
+
+def run_sweep(blast_input, blast_output, trn_gene_dict, output_file,
+	k, homThrs, gene_ot_thrs, oligo_ot_thrs, chunksize, gzip_output = False):
+	'''
+	Filter the BLASTN output of a single gene with every combination of
+	thresholds. The BLASTN output is read only once, and the maximum homology
+	and off-target hits are shared by all combinations.
+
+	Args:
+		blast_input (string): path to BLASTN input fasta file.
+		blast_output (string): path to BLASTN output with outfmt 6, or to
+			hit store folder.
+		trn_gene_dict (dict): TRANSCRIPT_ID:GENE_SYMBOL dictionary, not
+			needed for hit stores.
+		output_file (string): path to output fasta file, tagged with the
+			thresholds of every combination.
+		k (int): oligo length in nt.
+		homThrs (list): homology thresholds, as fraction of k.
+		gene_ot_thrs (list): thresholds on the number of off-target genes.
+		oligo_ot_thrs (list): thresholds on the number of oligos per
+			off-target.
+		chunksize (int): number of BLASTN output rows per chunk.
+		gzip_output (bool): compress the outputs with gzip, adding a .gz
+			extension if missing.
+
+	Return:
+		pd.DataFrame: number of passing oligos per combination.
+	'''
+
+	# Read BLASTN output once, at the lowest homology threshold ----------------
+	print(" · Reading BLASTN output...")
+	if os.path.isdir(blast_output):
+		(max_homology, ot_hits) = read_blast_store(
+			blast_output, blast_input, k, min(homThrs), True)
+	else:
+		(max_homology, ot_hits) = read_blast_output_columnar(
+			blast_output, trn_gene_dict, k, min(homThrs), chunksize, True)
+
+	# Filter with every combination --------------------------------------------
+	summary = []
+	for homThr in sorted(homThrs):
+
+		# Off-target hits above the current homology threshold
+		hits = ot_hits[ot_hits['homology'] >= homThr].groupby(
+			['oid', 'gene', 'transcript'])['n'].sum().reset_index()
+
+		for gene_ot_thr in sorted(gene_ot_thrs):
+			for oligo_ot_thr in sorted(oligo_ot_thrs):
+				print(" · Filtering with ht=%f, gt=%d, st=%d..." % (
+					homThr, gene_ot_thr, oligo_ot_thr))
+				output_ids = filter_oligos_columnar(max_homology, hits,
+					homThr, gene_ot_thr, oligo_ot_thr)
+				print(" · %d oligos can be used for further screening." % (
+					len(output_ids),))
+
+				# Prepare output
+				fname = sweep_output_path(output_file,
+					homThr, gene_ot_thr, oligo_ot_thr)
+				if gzip_output and not compression(fname) in ('gzip', 'bgzip'):
+					fname += '.gz'
+				print(" · Generating FASTA output: %s" % (fname,))
+				write_output(blast_input, fname, output_ids, gzip_output)
+
+				summary.append((homThr, gene_ot_thr, oligo_ot_thr,
+					len(output_ids)))
+
+	return(pd.DataFrame(summary, columns = ['homology_thr', 'gene_thr',
+		'saturation_thr', 'n_oligos']))
+
+# RUN ==========================================================================
+
+if __name__ == '__main__':
+
+	# Parse arguments
+	args = parse_arguments()
+
+	# Assign to in-script variables
+	blast_input = args.blastInput[0]
+	blast_output = args.blastOutput[0]
+	gene_transcript_table = args.geneTranscriptTable[0]
+	output_file = args.output[0]
+	k = args.k[0]
+	homThrs = sorted(set(args.homology_thr))
+	gene_ot_thrs = sorted(set(args.gene_thr))
+	oligo_ot_thrs = sorted(set(args.saturation_thr))
+	columnar = args.columnar
+	chunksize = args.chunksize[0]
+	gzip_output = args.gzip_output
+
+	# Sweep if more than one threshold combination is provided
+	sweep = 1 < len(homThrs) * len(gene_ot_thrs) * len(oligo_ot_thrs)
+
+	# Log to screen the settings
+	if sweep:
+		print("""
+Settings:
+              BLASTN input : %s
+             BLASTN output : %s
+     Gene-Transcript table : %s
+               Output file : %s
+                         K : %d
+       Homology thresholds : %s
+      Gene Off-Target thrs : %s
+Off-Target saturation thrs : %s
+               Gzip output : %r
+
+""" % (blast_input, blast_output, gene_transcript_table, output_file, k,
+			", ".join("%f" % t for t in homThrs),
+			", ".join("%d" % t for t in gene_ot_thrs),
+			", ".join("%d" % t for t in oligo_ot_thrs), gzip_output))
+	else:
+		(homThr, gene_ot_thr, oligo_ot_thr) = (
+			homThrs[0], gene_ot_thrs[0], oligo_ot_thrs[0])
+		print_settings(blast_input, blast_output, gene_transcript_table,
+			output_file, k, homThr, gene_ot_thr, oligo_ot_thr, columnar,
+			gzip_output)
+
+	print("Run:")
+
+	# Build TRANSCRIPT_ID:GENE_SYMBOL dictionary -------------------------------
+	if os.path.isdir(blast_output):
+		trn_gene_dict = None
+	else:
+		print(" · Building TRANSCRIPT_ID:GENE_SYMBOL dictionary...")
+		trn_gene_dict = read_trn_gene_dict(gene_transcript_table)
+
+	# Filter -------------------------------------------------------------------
+	if sweep:
+		summary = run_sweep(blast_input, blast_output, trn_gene_dict,
+			output_file, k, homThrs, gene_ot_thrs, oligo_ot_thrs, chunksize,
+			gzip_output)
+
+		# Write summary matrix
+		summary_file = "%s.sweep.tsv" % (split_output_path(output_file)[0],)
+		print(" · Writing sweep summary: %s" % (summary_file,))
+		summary.to_csv(summary_file, sep = '\t', index = False)
+	else:
+		run_filter(blast_input, blast_output, trn_gene_dict, output_file,
+			k, homThr, gene_ot_thr, oligo_ot_thr, columnar, chunksize,
+			gzip_output)
 
-# END ==========================================================================
+	# END ======================================================================
 
-print("""
+	print("""
 DONE!
 """)
 
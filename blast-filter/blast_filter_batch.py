@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ------------------------------------------------------------------------------
+# 
+# Author: Gabriele Girelli
+# Email: gigi.ga90@gmail.com
+# Version: 1.1.0
+# Date: 20170724
+# Project: RNA FISH oligo design
+# Description:	run blast_filter on every gene of a folder, in a single process.
+# 
+# Notes:
+# 		The input folder should contain, for every gene, a BLAST input fasta
+# 		file (GENE.fa) and the corresponding BLAST output with outfmt 6
+# 		(GENE.blast.out.tsv). The TRANSCRIPT_ID:GENE_SYMBOL table is read
+# 		only once and shared by all genes.
+# 		For every gene, the filtered fasta (outdir/GENE.fa) and the log of
+# 		blast_filter (outdir/GENE.fa.log) are generated.
+# 		With --store, the hits of every gene are read from a single hit store
+# 		built with blast_store.py, and only the fasta files are needed.
+# 
+# Changelog:
+# 		1.0.0: first implementation.
+# 		1.1.0: added support for binary hit stores (blast_store.py).
+# 
+# ------------------------------------------------------------------------------
+
+
+
+# DEPENDENCIES =================================================================
+
+import argparse
+from contextlib import redirect_stdout
+import os
+
+from blast_filter import print_settings, read_trn_gene_dict, run_filter
+
+# PARAMETERS ===================================================================
+
+# Add script description
+parser = argparse.ArgumentParser(
+	description = 'Filter BLASTN output of every gene in a folder.'
+)
+
+# Add mandatory arguments
+parser.add_argument('indir', type = str, nargs = 1,
+	help = 'Path to folder with BLAST input fasta and output files.')
+parser.add_argument('geneTranscriptTable', type = str, nargs = 1,
+	help = """Path to table with TRANSCRIPT_ID:GENE_SYMBOL
+	tabulation-separated columns.""")
+parser.add_argument('outdir', type = str, nargs = 1,
+	help = 'Path to output folder.')
+
+# Add arguments with default value
+parser.add_argument('-k', type = int, nargs = 1,
+	metavar = 'k', help = """Oligonucleotide length in nt.
+	Default: 30.""", default = [30])
+parser.add_argument('-t', '--homology-thr', type = float, nargs = 1,
+	metavar = 'ht', help = """Threshold on maximum homology, as fraction of k.
+	Accepts float values from 0 to 1.
+	Default: .85""", default = [.85])
+parser.add_argument('-g', '--gene-thr', type = int, nargs = 1,
+	metavar = 'gt', help = """Threshold on the number of off-targets gene,
+	for a single oligo.
+	Default: 20""", default = [20])
+parser.add_argument('-s', '--saturation-thr', type = int, nargs = 1,
+	metavar = 'st', help = """
+	Threshold on the number of oligos off-targeting a gene,
+	for the selections of 'saturated' off-target genes. Oligos targeting
+	a saturated off-target are filtered out.
+	Default: 5""", default = [5])
+parser.add_argument('--chunksize', type = int, nargs = 1,
+	metavar = 'cs', help = """
+	Number of BLASTN output rows per chunk, in columnar mode.
+	Default: 1000000""", default = [1000000])
+parser.add_argument('--fasta-ext', type = str, nargs = 1,
+	metavar = 'fext', help = """
+	Extension of the BLAST input fasta files. Default: '.fa'""",
+	default = ['.fa'])
+parser.add_argument('--blast-ext', type = str, nargs = 1,
+	metavar = 'bext', help = """
+	Extension of the BLAST output files. Default: '.blast.out.tsv'""",
+	default = ['.blast.out.tsv'])
+parser.add_argument('--store', type = str, nargs = 1,
+	metavar = 'store', help = """
+	Hit store folder, built with blast_store.py, to be used instead of the
+	per-gene BLAST outputs.""", default = [None])
+
+# Add flags
+parser.add_argument('--columnar',
+	action = 'store_const', dest = 'columnar',
+	const = True, default = False,
+	help = """Load the BLASTN output in chunks of typed columns and filter
+	with vectorized group-by reductions.""")
+parser.add_argument('--gzip',
+	action = 'store_const', dest = 'gzip_output',
+	const = True, default = False,
+	help = 'Write gzip-compressed FASTA outputs (GENE.fa.gz).')
+
+# Parse arguments
+args = parser.parse_args()
+
+# Assign to in-script variables
+indir = args.indir[0]
+gene_transcript_table = args.geneTranscriptTable[0]
+outdir = args.outdir[0]
+k = args.k[0]
+homThr = args.homology_thr[0]
+gene_ot_thr = args.gene_thr[0]
+oligo_ot_thr = args.saturation_thr[0]
+chunksize = args.chunksize[0]
+fasta_ext = args.fasta_ext[0]
+blast_ext = args.blast_ext[0]
+store_path = args.store[0]
+columnar = args.columnar
+gzip_output = args.gzip_output
+
+# Create outdir if it does not exist
+if not os.path.isdir(outdir):
+	os.mkdir(outdir)
+
+# FUNCTIONS ====================================================================
+
+def list_genes(indir, fasta_ext, blast_ext):
+	'''
+	Args:
+		indir (string): path to input folder.
+		fasta_ext (string): extension of the BLAST input fasta files.
+		blast_ext (string): extension of the BLAST output files, None when
+			using a hit store.
+
+	Return:
+		list: names of the genes with both BLAST input and output.
+	'''
+
+	if blast_ext is None:
+		return([fname[:-len(fasta_ext)] for fname in sorted(os.listdir(indir))
+			if fname.endswith(fasta_ext)])
+
+	genes = []
+	for fname in sorted(os.listdir(indir)):
+		if not fname.endswith(blast_ext):
+			continue
+
+		gene = fname[:-len(blast_ext)]
+		if os.path.isfile(os.path.join(indir, gene + fasta_ext)):
+			genes.append(gene)
+		else:
+			print(" !!! Skipping %s, BLAST input not found." % (gene,))
+
+	return(genes)
+
+# RUN ==========================================================================
+
+print("""
+Settings:
+                Input folder : %s
+       Gene-Transcript table : %s
+               Output folder : %s
+""" % (indir, gene_transcript_table, outdir))
+
+print("Run:")
+
+# Build TRANSCRIPT_ID:GENE_SYMBOL dictionary once ------------------------------
+if store_path is None:
+	print(" · Building TRANSCRIPT_ID:GENE_SYMBOL dictionary...")
+	trn_gene_dict = read_trn_gene_dict(gene_transcript_table)
+	genes = list_genes(indir, fasta_ext, blast_ext)
+else:
+	trn_gene_dict = None
+	genes = list_genes(indir, fasta_ext, None)
+
+# Filter every gene ------------------------------------------------------------
+print(" · Filtering %d genes..." % (len(genes),))
+
+for gene in genes:
+	print(" >>> %s" % (gene,))
+
+	blast_input = os.path.join(indir, gene + fasta_ext)
+	if store_path is None:
+		blast_output = os.path.join(indir, gene + blast_ext)
+	else:
+		blast_output = store_path
+	output_file = os.path.join(outdir, gene + fasta_ext)
+	if gzip_output:
+		output_file += '.gz'
+
+	# Log each gene to its own file, as a single blast_filter run would
+	with open(output_file + '.log', 'w') as logf, redirect_stdout(logf):
+		print_settings(blast_input, blast_output, gene_transcript_table,
+			output_file, k, homThr, gene_ot_thr, oligo_ot_thr, columnar,
+			gzip_output)
+		print("Run:")
+		run_filter(blast_input, blast_output, trn_gene_dict, output_file,
+			k, homThr, gene_ot_thr, oligo_ot_thr, columnar, chunksize,
+			gzip_output)
+		print("""
+DONE!
+""")
+
+# END ==========================================================================
+
+print("""
+DONE!
+""")
+
+################################################################################
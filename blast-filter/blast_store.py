@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ------------------------------------------------------------------------------
+# 
+# Author: Gabriele Girelli
+# Email: gigi.ga90@gmail.com
+# Version: 1.1.0
+# Date: 20170724
+# Project: RNA FISH oligo design
+# Description:	convert BLASTN output (outfmt 6) into a binary hit store.
+# 
+# Notes:
+# 		The store is a folder of NumPy arrays, memory-mapped when read:
+# 			oligo.ids			sorted oligo IDs (fixed-width bytes).
+# 			oligo.target		gene code of the targeted gene, per oligo.
+# 			oligo.offset		offset of the first hit of every oligo.
+# 			hit.transcript		transcript code, per hit.
+# 			hit.matches			alignment length minus mismatches, per hit.
+# 			transcript.ids		transcript IDs (fixed-width bytes).
+# 			transcript.gene		gene code, per transcript.
+# 			gene.ids			gene symbols (fixed-width bytes).
+# 		Hits are sorted by oligo, so that the hits of oligo i are found at
+# 		[oligo.offset[i], oligo.offset[i+1]). Homology is hit.matches / k,
+# 		so the same store serves any k, homology, gene OT and saturation
+# 		threshold.
+# 
+# Changelog:
+# 		1.0.0: first implementation.
+# 		1.1.0: compressed inputs (.gz, .bgz, .zst), by extension.
+# 
+# ------------------------------------------------------------------------------
+
+
+
+# DEPENDENCIES =================================================================
+
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+from compressed_io import xopen
+
+# PARAMETERS ===================================================================
+
+# Arrays in a hit store
+STORE_FILES = ['oligo.ids', 'oligo.target', 'oligo.offset', 'hit.transcript',
+	'hit.matches', 'transcript.ids', 'transcript.gene', 'gene.ids']
+
+def parse_arguments():
+	'''Parse command line arguments.'''
+
+	# Add script description
+	parser = argparse.ArgumentParser(
+		description = 'Convert BLASTN output into a binary hit store.'
+	)
+
+	# Add mandatory arguments
+	parser.add_argument('blastOutput', type = str, nargs = 1,
+		help = 'Path to BLAST output with outfmt 6.')
+	parser.add_argument('geneTranscriptTable', type = str, nargs = 1,
+		help = """Path to table with TRANSCRIPT_ID:GENE_SYMBOL
+		tabulation-separated columns.""")
+	parser.add_argument('store', type = str, nargs = 1,
+		help = 'Path to output store folder.')
+
+	# Add arguments with default value
+	parser.add_argument('--chunksize', type = int, nargs = 1,
+		metavar = 'cs', help = """
+		Number of BLASTN output rows per chunk. Default: 1000000""",
+		default = [1000000])
+
+	# Parse arguments
+	return(parser.parse_args())
+
+# FUNCTIONS ====================================================================
+
+def build_store(blast_output, gene_transcript_table, store_path, chunksize):
+	'''
+	Args:
+		blast_output (string): path to BLASTN output with outfmt 6.
+		gene_transcript_table (string): path to TRANSCRIPT_ID:GENE_SYMBOL table.
+		store_path (string): path to output store folder.
+		chunksize (int): number of BLASTN output rows per chunk.
+	'''
+
+	# Categorical TRANSCRIPT_ID:GENE_SYMBOL index
+	with xopen(gene_transcript_table) as gttf:
+		gtt = pd.read_csv(gttf, sep = '\t', header = None,
+			usecols = [0, 1], dtype = str)
+
+	# Repeated transcripts: the last row wins, as in read_trn_gene_dict
+	gtt = gtt.drop_duplicates(0, keep = 'last')
+	trn_index = pd.Index(gtt[0].values)
+	genes = pd.Categorical(gtt[1].values)
+	gene_index = genes.categories
+
+	# Oligo ID : provisional code, in order of appearance
+	oid_map = {}
+	oligo_target = []
+
+	oligo_parts = []
+	transcript_parts = []
+	matches_parts = []
+
+	blast_file = xopen(blast_output)
+	try:
+		reader = pd.read_csv(blast_file, sep = '\t', header = None,
+			usecols = [0, 1, 3, 4], chunksize = chunksize,
+			dtype = {0 : 'category', 1 : 'category', 3 : np.int32, 4 : np.int32})
+		for chunk in reader:
+
+			# Identify oligomer ID and target gene, once per distinct query
+			queries = chunk[0].cat.categories
+			oids = queries.str.split(':').str[0]
+			targets = gene_index.get_indexer(queries.str.split('_').str[0])
+			for (oid, target) in zip(oids, targets):
+				if not oid in oid_map:
+					oid_map[oid] = len(oid_map)
+					oligo_target.append(target)
+			qcodes = np.array([oid_map[oid] for oid in oids], dtype = np.int64)
+			oligo_parts.append(qcodes[chunk[0].cat.codes.values])
+
+			# Identify transcript ID, once per distinct subject
+			subjects = chunk[1].cat.categories.str.split('.').str[0]
+			trn_pos = trn_index.get_indexer(subjects)
+			if (trn_pos < 0).any():
+				raise KeyError(subjects[trn_pos < 0][0])
+			transcript_parts.append(
+				trn_pos[chunk[1].cat.codes.values].astype(np.int32))
+
+			# Perfect matches
+			matches = chunk[3].values - chunk[4].values
+			if 0 != len(matches) and matches.max() > 255:
+				raise ValueError("Alignments longer than 255 nt are not supported.")
+			matches_parts.append(matches.astype(np.uint8))
+	except pd.errors.EmptyDataError:
+		pass
+	finally:
+		blast_file.close()
+
+	if 0 == len(oligo_parts):
+		oligo = np.zeros(0, dtype = np.int64)
+		transcript = np.zeros(0, dtype = np.int32)
+		matches = np.zeros(0, dtype = np.uint8)
+	else:
+		oligo = np.concatenate(oligo_parts)
+		transcript = np.concatenate(transcript_parts)
+		matches = np.concatenate(matches_parts)
+
+	# Sort oligo IDs, and re-code hits accordingly
+	oligo_ids = np.array(list(oid_map.keys()), dtype = 'S')
+	order = np.argsort(oligo_ids, kind = 'stable')
+	rank = np.empty(len(order), dtype = np.int64)
+	rank[order] = np.arange(len(order))
+	oligo = rank[oligo]
+
+	# Sort hits by oligo, and index them
+	hit_order = np.argsort(oligo, kind = 'stable')
+	offset = np.searchsorted(oligo[hit_order], np.arange(len(order) + 1))
+
+	# Write
+	if not os.path.isdir(store_path):
+		os.mkdir(store_path)
+	arrays = {
+		'oligo.ids' : oligo_ids[order],
+		'oligo.target' : np.array(oligo_target, dtype = np.int32)[order],
+		'oligo.offset' : offset.astype(np.int64),
+		'hit.transcript' : transcript[hit_order],
+		'hit.matches' : matches[hit_order],
+		'transcript.ids' : np.array(trn_index.values, dtype = 'S'),
+		'transcript.gene' : genes.codes.astype(np.int32),
+		'gene.ids' : np.array(gene_index.values, dtype = 'S')
+	}
+	for name in STORE_FILES:
+		np.save(os.path.join(store_path, name + '.npy'), arrays[name])
+
+	return((len(order), len(oligo)))
+
+def load_store(store_path):
+	'''
+	Args:
+		store_path (string): path to store folder.
+
+	Return:
+		dict: memory-mapped store arrays, by name.
+	'''
+
+	return(dict((name, np.load(os.path.join(store_path, name + '.npy'),
+		mmap_mode = 'r')) for name in STORE_FILES))
+
+def select_hits(store, oligo_ids):
+	'''
+	Retrieve the hits of the selected oligos, without reading the rest of
+	the store.
+
+	Args:
+		store (dict): memory-mapped store arrays, from load_store.
+		oligo_ids (iterable): IDs of the oligos of interest.
+
+	Return:
+		tuple: (ids, owner, transcript, gene, target, matches). ids are the
+		oligo IDs found in the store, owner the position in ids of the oligo
+		of every hit. transcript, gene, target and matches are per-hit codes
+		of the hit transcript, its gene and the targeted gene, and the
+		number of perfect matches.
+	'''
+
+	# Look up oligo codes
+	store_ids = store['oligo.ids']
+	query = np.array(sorted(oligo_ids), dtype = 'S')
+	if 0 == len(store_ids) or 0 == len(query):
+		pos = np.zeros(0, dtype = np.int64)
+		query = query[:0]
+	else:
+		pos = np.minimum(np.searchsorted(store_ids, query), len(store_ids) - 1)
+		found = store_ids[pos] == query
+		(pos, query) = (pos[found], query[found])
+
+	# Expand [start, end) hit ranges
+	starts = store['oligo.offset'][pos]
+	lens = store['oligo.offset'][pos + 1] - starts
+	owner = np.repeat(np.arange(len(pos)), lens)
+	idx = np.arange(lens.sum()) - np.repeat(np.cumsum(lens) - lens, lens)
+	idx += np.repeat(starts, lens)
+
+	transcript = np.asarray(store['hit.transcript'][idx])
+	gene = np.asarray(store['transcript.gene'])[transcript]
+	target = np.asarray(store['oligo.target'][pos])[owner]
+	matches = np.asarray(store['hit.matches'][idx])
+
+	return((query.astype(str), owner, transcript, gene, target, matches))
+
+# RUN ==========================================================================
+
+if __name__ == '__main__':
+
+	# Parse arguments
+	args = parse_arguments()
+
+	# Assign to in-script variables
+	blast_output = args.blastOutput[0]
+	gene_transcript_table = args.geneTranscriptTable[0]
+	store_path = args.store[0]
+	chunksize = args.chunksize[0]
+
+	# Log to screen the settings
+	print("""
+Settings:
+             BLASTN output : %s
+     Gene-Transcript table : %s
+                     Store : %s
+
+""" % (blast_output, gene_transcript_table, store_path))
+
+	print("Run:")
+	print(" · Converting BLASTN output...")
+	(n_oligo, n_hit) = build_store(blast_output, gene_transcript_table,
+		store_path, chunksize)
+	print(" >>> Stored %d hits of %d oligos." % (n_hit, n_oligo))
+
+	# END ======================================================================
+
+	print("""
+DONE!
+""")
+
+################################################################################
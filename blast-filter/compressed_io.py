@@ -0,0 +1 @@
+../680-genes-fish-oligos/compressed_io.py
\ No newline at end of file